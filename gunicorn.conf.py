@@ -0,0 +1,96 @@
+"""
+Gunicorn configuration
+
+The app is created once by the master and shared by the forked workers
+(preload_app), which skip the creation of the tables. The master creates
+them once before forking and closes its connections, then every worker
+opens its own database connections and storage client in post_worker_init.
+
+Concurrency
+    GUNICORN_WORKER_CLASS selects how a worker serves its requests:
+
+    - sync: one request at a time, scale with GUNICORN_WORKERS only.
+    - gthread: GUNICORN_THREADS requests at a time in every worker. Set
+      DB_POOL_SIZE to the number of threads so no request waits for a
+      connection.
+    - gevent: up to GUNICORN_WORKER_CONNECTIONS requests at a time, the
+      photo uploads and the database calls yield to the other requests.
+      Install gevent and psycogreen, the psycopg2 driver is made
+      cooperative in every worker. The database connections stay bounded
+      by DB_POOL_SIZE + DB_MAX_OVERFLOW, the other requests wait for one
+      up to DB_POOL_TIMEOUT seconds.
+    - uvicorn.workers.UvicornWorker, with service.asgi:application instead
+      of service:app: the read routes run as coroutines on an async engine,
+      the other routes on ASGI_SYNC_THREADS threads, see service/asgi.py.
+
+    Every request gets its own app context and database session, scoped
+    to its thread or greenlet and removed when the request ends, so the
+    requests of a worker never share a session.
+
+Set PROMETHEUS_MULTIPROC_DIR to add up the metrics of the workers at
+/metrics, see service/common/metrics.py.
+
+All the settings can be changed with the GUNICORN_* environment variables.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Only the master creates the tables, in on_starting
+os.environ.setdefault("DB_CREATE_ALL", "false")
+# One pooled connection per thread
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+# The writes only invalidate the cache of their worker, the per process
+# memory cache would serve stale documents from the other workers
+if workers > 1:
+    os.environ.setdefault("CACHE_BACKEND", "null")
+
+
+def on_starting(server):
+    """Creates the missing tables once, then closes the master connections"""
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.common import metrics
+    from service.models import db
+
+    # the metrics of the last run, the pids may be reused by the new workers
+    metrics.clean_directory()
+    if workers > 1 and app.config["CACHE_BACKEND"] == "memory":
+        server.log.warning("The memory cache of every worker serves stale documents, use a shared CACHE_BACKEND")
+    server.log.info("Creating the missing tables")
+    db.create_all(app=app)
+    db.get_engine(app).dispose()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the gauges of an exited worker and keeps its counters in one file"""
+    from service.common import metrics  # pylint: disable=import-outside-toplevel
+
+    metrics.worker_exited(worker.pid)
+
+
+def post_worker_init(worker):
+    """
+    Replaces the connections inherited from the master with the worker ones
+
+    This runs after gevent patched the worker, so the new connections are
+    cooperative.
+    """
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            worker.log.warning("psycogreen is not installed, the database calls block the worker")
+        else:
+            patch_psycopg()
+    # pylint: disable=import-outside-toplevel
+    from service import app, init_worker
+
+    init_worker(app)
@@ -7,12 +7,10 @@ and SQL database
 import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, storage, cache, json_provider, compression, metrics, timing
+from service.common import pooling, replicas
 from flask_talisman import Talisman
 from flask_cors import CORS
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object(config)
 
 # Add talisman security
 #NOTE: USE ENVIRONMENT VARIABLE TO SET THIS
@@ -22,29 +20,80 @@ csp = {
         'localhost',
     ]
 }
-talisman = Talisman(app, content_security_policy=csp)
-talisman.force_https= False
-CORS(app)
+talisman = Talisman()
 
-# Import the routes After the Flask app is created
-# pylint: disable=wrong-import-position, cyclic-import, wrong-import-order
-from service import routes, models  # noqa: F401 E402
 
-# pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401 E402
+def create_app():
+    """
+    Creates and configures the Flask application
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    Nothing connects to the database or to the storage here, besides the
+    creation of the tables when DB_CREATE_ALL is set, so the app can be
+    loaded once by the gunicorn master (--preload) and shared by the forked
+    workers, see init_worker.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-app.logger.info(70 * "*")
-app.logger.info("  A C C O U N T   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    talisman.init_app(app, content_security_policy=csp)
+    talisman.force_https = False
+    CORS(app)
 
-try:
-    models.init_db(app)  # make our database tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    # Import the routes After the Flask app is created
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service import routes, models
+    from service.common import error_handlers, cli_commands
 
-app.logger.info("Service initialized!")
+    app.register_blueprint(routes.api)
+    app.register_blueprint(error_handlers.errors)
+    app.register_blueprint(cli_commands.commands)
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+
+    app.logger.info(70 * "*")
+    app.logger.info("  A C C O U N T   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    json_provider.init_json(app)
+    compression.init_compression(app)
+    storage.init_storage(app)
+    cache.init_cache(app, models.db.session)
+    metrics.init_metrics(app, lambda: models.db.get_engine(app))
+    timing.init_timing(app)
+    pooling.init_pool(app)
+    replicas.init_replicas(app, models.db.session)
+
+    try:
+        models.init_db(app)  # make our database tables
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    app.logger.info("Service initialized!")
+    return app
+
+
+def init_worker(app):
+    """
+    Prepares a forked worker before its first request
+
+    The connections inherited from the master, replicas included, are
+    dropped without closing them, they still belong to the master, then the
+    worker opens its own pool connections and storage client.
+    """
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service.models import db
+
+    engine = db.get_engine(app)
+    engine.dispose(close=False)
+    connections = [engine.connect() for _ in range(app.config["DB_POOL_WARM"])]
+    for connection in connections:
+        connection.close()
+    replicas.dispose_replicas(close=False)
+    storage.get_storage().warm()
+    app.logger.info("Worker initialized with %s database connections", len(connections))
+
+
+app = create_app()
@@ -0,0 +1,293 @@
+"""
+Async read API
+
+Optional ASGI entry point of the service. The read only routes, which spend
+their time waiting for the database, are served by coroutines on an async
+SQLAlchemy engine: GET /employe, GET /employe/<id> and /health. A worker
+keeps many slow requests in flight with a single thread. Every other request
+goes to the Flask app, run on a pool of ASGI_SYNC_THREADS threads.
+
+The coroutines run inside a Flask request context, so they share the
+argument parsing, the cache, the serializers of the models, the error
+handlers and the after_request hooks (compression, metrics, Server-Timing)
+of the sync routes, and answer the same documents and ETags. The sparse
+reads (?fields=, ?include=) are left to the sync routes.
+
+The async driver is derived from the database uri (asyncpg for PostgreSQL,
+aiosqlite for SQLite) unless ASYNC_DATABASE_URI is set. Serve it with:
+  gunicorn --config=gunicorn.conf.py -k uvicorn.workers.UvicornWorker service.asgi:application
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import abort, jsonify, make_response, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Query
+from sqlalchemy.pool import NullPool
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+from service import app, routes
+from service.common import cache, pooling, status
+from service.models import Employed
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_uri(config):
+    """Returns ASYNC_DATABASE_URI, or the database uri with the async driver of its dialect"""
+    if config["ASYNC_DATABASE_URI"]:
+        return make_url(config["ASYNC_DATABASE_URI"])
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def async_engine_options(config):
+    """
+    Returns the DB_POOL_* engine options, the async engine brings its own queue pool
+
+    asyncpg prepares the statements on every connection, behind a pooler in
+    transaction mode (DB_POOL_MODE null) the next transaction may run on
+    another server connection, so the statement caches are turned off.
+    """
+    options = pooling.engine_options(config)
+    if options.pop("poolclass", None) is pooling.InstrumentedNullPool:
+        options["poolclass"] = NullPool
+        if async_database_uri(config).get_driver_name() == "asyncpg":
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    return options
+
+
+async def run_sync(connection, method, **kwargs):
+    """Awaits a read method of the models on a connection of the async engine"""
+    return await connection.run_sync(lambda sync_connection: method(connection=sync_connection, **kwargs))
+
+
+######################################################################
+#  A S Y N C   V I E W S
+#  A view returns None to leave the request to the sync routes
+######################################################################
+async def health(api):  # pylint: disable=unused-argument
+    """Health Status"""
+    return routes.health()
+
+
+async def list_accounts(api):
+    """Reads all the Employes, or a page of them, like routes.list_accounts"""
+    if routes.get_sparse_args() is not None:
+        return None
+    query = Employed.find_by_filters(query=Query(Employed), **routes.get_filter_args())
+    if "limit" not in request.args and "cursor" not in request.args:
+        async with api.get_engine().connect() as connection:
+            etag = await run_sync(connection, Employed.collection_etag)
+            match = routes.none_match(etag)
+            if match is not None:
+                return routes.not_modified(match)
+            employes = await run_sync(connection, Employed.read_documents, query=query)
+        return routes.list_response(employes, etag)
+
+    after, limit = routes.get_page_args()
+    async with api.get_engine().connect() as connection:
+        employes, etags = await run_sync(
+            connection, Employed.read_documents, query=query, after=after, limit=limit + 1, etags=True
+        )
+    return routes.page_response(employes, etags, after, limit)
+
+
+async def read_an_account(api, employe_id):
+    """Reads an Employe through the cache, like routes.read_an_account"""
+    if routes.get_sparse_args() is not None:
+        return None
+    employe_cache = cache.get_cache()
+    entry = employe_cache.get(employe_id)
+    if entry is None:
+        generation = employe_cache.generation()
+        query = Query(Employed).filter(Employed.id == employe_id)
+        async with api.get_engine().connect() as connection:
+            documents, etags = await run_sync(connection, Employed.read_documents, query=query, etags=True)
+        if not documents:
+            abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe_id}] not found")
+        entry = {"etag": etags[0], "document": documents[0]}
+        employe_cache.set(employe_id, entry, generation)
+    match = routes.none_match(entry["etag"])
+    if match is not None:
+        return routes.not_modified(match)
+    response = make_response(jsonify(entry["document"]), status.HTTP_200_OK)
+    response.set_etag(entry["etag"])
+    return response
+
+
+######################################################################
+#  A S G I   A P P
+######################################################################
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    """
+    Runs a request of the Flask app on a pool of threads
+
+    WsgiToAsgi runs the requests with a thread sensitive sync_to_async, one
+    at a time on a single thread, these run up to the size of the pool at once.
+    """
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):  # pylint: disable=invalid-overridden-method
+        run = functools.partial(WsgiToAsgiInstance.run_wsgi_app.__wrapped__, self)
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(body)
+
+
+class AsyncReadAPI:
+    """
+    ASGI app serving the read routes with coroutines and the others with Flask
+
+    Args:
+        flask_app (Flask): the app created by create_app
+    """
+
+    VIEWS = {
+        "api.health": health,
+        "api.list_accounts": list_accounts,
+        "api.read_an_account": read_an_account,
+    }
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.executor = ThreadPoolExecutor(flask_app.config["ASGI_SYNC_THREADS"], thread_name_prefix="wsgi")
+        self.engine = None
+
+    def get_engine(self):
+        """Returns the async engine, created in the worker by the first request"""
+        if self.engine is None:
+            config = self.app.config
+            self.engine = create_async_engine(async_database_uri(config), **async_engine_options(config))
+        return self.engine
+
+    async def wsgi(self, scope, receive, send):
+        """Serves a request with the Flask app, on the thread pool"""
+        await ThreadedWsgiInstance(self.app, self.executor)(scope, receive, send)
+
+    async def dispose(self):
+        """Closes the connections of the async engine"""
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            environ = wsgi_environ(scope)
+            view, view_args = self.match(environ)
+            if view is not None:
+                response = await self.dispatch(environ, view, view_args)
+                if response is not None:
+                    await send_response(response, environ, send)
+                    return
+        await self.wsgi(scope, receive, send)
+
+    def match(self, environ):
+        """Returns the async view of a request and its arguments, None for the sync routes"""
+        try:
+            endpoint, view_args = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None, None
+        return self.VIEWS.get(endpoint), view_args
+
+    async def dispatch(self, environ, view, view_args):
+        """Runs a view in a new request context, like Flask.wsgi_app does"""
+        with self.app.app_context(), self.app.request_context(environ):
+            try:
+                try:
+                    result = self.app.preprocess_request()
+                    if result is None:
+                        result = await view(self, **view_args)
+                        if result is None:
+                            return None
+                except Exception as error:  # pylint: disable=broad-except
+                    result = self.app.handle_user_exception(error)
+                return self.app.finalize_request(result)
+            except Exception as error:  # pylint: disable=broad-except
+                return self.app.handle_exception(error)
+
+    async def lifespan(self, receive, send):
+        """Closes the async engine when the server shuts down"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                self.executor.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def wsgi_environ(scope):
+    """Builds the WSGI environ of a bodiless ASGI http request"""
+    host, port = scope.get("server") or ("localhost", 80)
+    headers = [(name.decode("latin1"), value.decode("latin1")) for name, value in scope["headers"]]
+    environ = EnvironBuilder(
+        path=scope["path"],
+        base_url=f"{scope.get('scheme', 'http')}://{host}:{port}{scope.get('root_path', '')}",
+        query_string=scope["query_string"].decode("latin1"),
+        method=scope["method"],
+        headers=headers,
+    ).get_environ()
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    return environ
+
+
+async def send_response(response, environ, send):
+    """Sends a Flask response to the ASGI server"""
+    try:
+        headers = response.get_wsgi_headers(environ)
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers.items()],
+        })
+        for chunk in response.get_app_iter(environ):
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        response.close()
+
+
+async def fetch(application, path, headers=None):
+    """Sends a GET request to an ASGI app in process, returns its (status, headers, body)"""
+    path, _, query_string = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("latin1"),
+        "root_path": "",
+        "query_string": query_string.encode("latin1"),
+        "headers": [(b"host", b"localhost")] + [
+            (name.lower().encode("latin1"), value.encode("latin1")) for name, value in (headers or {}).items()
+        ],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 0),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    start, body = messages[0], b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], {k.decode("latin1"): v.decode("latin1") for k, v in start["headers"]}, body
+
+
+application = AsyncReadAPI(app)
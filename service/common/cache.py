@@ -0,0 +1,227 @@
+"""
+Employe document cache
+
+GET /employe/<id> reads the serialized Employe, beneficiaries included,
+through this cache. The entries of the Employes written by a transaction
+are dropped when it commits, whatever route or thread made the change.
+The backend is selected with CACHE_BACKEND: "memory" for a per process
+LRU with TTL, "null" to disable it, or "package.module:factory" for a
+shared cache, the factory receives the app config and returns an object
+with get, set, delete and clear methods.
+
+A document read before an invalidation of the process is not stored, see
+EmployeCache.generation. The invalidations only reach the cache of the
+process that committed: with the "memory" backend every gunicorn worker
+would keep serving its entries of the Employes written by the others until
+CACHE_TTL, so gunicorn.conf.py defaults CACHE_BACKEND to "null" when there
+are many workers. Use a shared backend to cache with many workers.
+"""
+import importlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+CACHE = None
+
+
+class MemoryCache:
+    """A thread safe LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value of a key, None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used one when full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes a key"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all the keys"""
+        with self._lock:
+            self._entries.clear()
+
+
+class NullCache:
+    """A cache that never stores anything"""
+
+    def get(self, key):  # pylint: disable=unused-argument
+        """Always misses"""
+        return None
+
+    def set(self, key, value):
+        """Does nothing"""
+
+    def delete(self, key):
+        """Does nothing"""
+
+    def clear(self):
+        """Does nothing"""
+
+
+class EmployeCache:
+    """Caches serialized Employes by id and counts the hits and misses"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0, "stale": 0}
+        # incremented by every invalidation, guarded by _write_lock
+        self._generation = 0
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _key(employe_id):
+        return f"employe:{employe_id}"
+
+    def get(self, employe_id):
+        """Returns the cached document of an Employe or None"""
+        document = self.backend.get(self._key(employe_id))
+        self._count("misses" if document is None else "hits")
+        return document
+
+    def generation(self):
+        """Returns the invalidation generation, read it before reading the document to cache"""
+        with self._write_lock:
+            return self._generation
+
+    def set(self, employe_id, document, generation=None):
+        """
+        Caches the document of an Employe
+
+        Args:
+            generation (int): the generation read before the document, the
+                document is not stored if any Employe was invalidated since,
+                it may be older than the committed change
+        """
+        with self._write_lock:
+            if generation is not None and generation != self._generation:
+                stale = True
+            else:
+                stale = False
+                self.backend.set(self._key(employe_id), document)
+        if stale:
+            self._count("stale")
+
+    def invalidate(self, employe_ids):
+        """Drops the documents of the Employes"""
+        for employe_id in employe_ids:
+            with self._write_lock:
+                self._generation += 1
+                self.backend.delete(self._key(employe_id))
+            self._count("invalidations")
+
+    def clear(self):
+        """Drops all the documents"""
+        with self._write_lock:
+            self._generation += 1
+            self.backend.clear()
+
+    def stats(self):
+        """Returns the hit, miss, invalidation and stale counters"""
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+
+def create_backend(config):
+    """Builds the backend selected by CACHE_BACKEND"""
+    backend = config["CACHE_BACKEND"]
+    if backend == "memory":
+        return MemoryCache(config["CACHE_MAX_SIZE"], config["CACHE_TTL"])
+    if backend == "null":
+        return NullCache()
+    module_name, _, factory = backend.partition(":")
+    return getattr(importlib.import_module(module_name), factory)(config)
+
+
+######################################################################
+#  I N V A L I D A T I O N
+######################################################################
+def _written_employes(session, flush_context):  # pylint: disable=unused-argument
+    """Remembers the Employes written by a flush"""
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service.models import Employed, Beneficiary
+
+    written = session.info.setdefault("written_employes", set())
+    for record in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(record, Employed):
+            written.add(record.id)
+        elif isinstance(record, Beneficiary):
+            written.add(record.employed_id)
+
+
+def _written_in_bulk(context):
+    """Remembers that a bulk UPDATE or DELETE may have written any Employe"""
+    context.session.info["written_in_bulk"] = True
+
+
+def _invalidate_written(session):
+    """Drops the Employes written by the committed transaction"""
+    written = session.info.pop("written_employes", None)
+    in_bulk = session.info.pop("written_in_bulk", False)
+    if CACHE is None:
+        return
+    if in_bulk:
+        CACHE.clear()
+    elif written:
+        CACHE.invalidate(written - {None})
+
+
+def _forget_written(session):
+    """Forgets the Employes of a rolled back transaction"""
+    session.info.pop("written_employes", None)
+    session.info.pop("written_in_bulk", None)
+
+
+def init_cache(app, session):
+    """Initializes the Employe cache and its invalidation on commit"""
+    global CACHE  # pylint: disable=global-statement
+    CACHE = EmployeCache(create_backend(app.config))
+    for name, listener in (
+        ("after_flush", _written_employes),
+        ("after_bulk_update", _written_in_bulk),
+        ("after_bulk_delete", _written_in_bulk),
+        ("after_commit", _invalidate_written),
+        ("after_rollback", _forget_written),
+    ):
+        if not event.contains(session, name, listener):
+            event.listen(session, name, listener)
+    app.logger.info("Using %s employe cache", app.config["CACHE_BACKEND"])
+
+
+def get_cache():
+    """Returns the Employe cache, a pass through one if not initialized"""
+    if CACHE is None:
+        return EmployeCache(NullCache())
+    return CACHE
@@ -1,8 +1,18 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+import click
+from flask import Blueprint, current_app
+from sqlalchemy import func
+from service.models import db, Employed, Beneficiary
+
+# The commands are registered on the app by create_app()
+commands = Blueprint("commands", __name__, cli_group=None)
 
 
 ######################################################################
@@ -10,7 +20,7 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@commands.cli.command("db-create")
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -19,3 +29,136 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to compare the ORM and the Core read paths
+# Usage:
+#   flask bench-reads --rows 10000 --rows 100000
+######################################################################
+@commands.cli.command("bench-reads")
+@click.option("--rows", multiple=True, type=int, default=[10000, 100000], show_default=True,
+              help="Number of Employes to read, can be repeated")
+@click.option("--repeat", default=3, show_default=True, help="Best time out of this many reads")
+def bench_reads(rows, repeat):
+    """
+    Times the listing of the Employes through the ORM and through the Core
+    fast path. The benchmark rows are inserted in the configured database
+    and deleted afterwards.
+    """
+    for count in rows:
+        ids = _insert_employes(count)
+        try:
+            orm = _best_of(repeat, lambda: [
+                dict(e.serialize(), beneficiaries=[b.serialize() for b in e.beneficiary])
+                for e in Employed.all()
+            ])
+            core = _best_of(repeat, Employed.read_documents)
+            click.echo(f"{count} rows: orm {orm:.3f}s, core {core:.3f}s ({orm / core:.1f}x)")
+        finally:
+            _delete_employes(ids)
+
+
+######################################################################
+# Command to compare the throughput of the sync and the async reads
+# Usage:
+#   flask bench-async --requests 2000 --concurrency 50
+######################################################################
+@commands.cli.command("bench-async")
+@click.option("--rows", default=1000, show_default=True, help="Number of Employes to insert")
+@click.option("--requests", "total", default=2000, show_default=True, help="Number of GET requests")
+@click.option("--concurrency", default=50, show_default=True, help="Requests in flight at the same time")
+@click.option("--path", default="/employe?limit=100", show_default=True, help="Route to read")
+def bench_async(rows, total, concurrency, path):
+    """
+    Measures the requests per second of a read route served by the Flask
+    app, with one thread per concurrent request like the gthread workers,
+    and by the async read API of service.asgi, with one coroutine per
+    request. Both run in process, without the network. The benchmark rows
+    are inserted in the configured database and deleted afterwards.
+    """
+    from service.asgi import AsyncReadAPI  # pylint: disable=import-outside-toplevel
+
+    ids = _insert_employes(rows)
+    try:
+        sync = _sync_throughput(path, total, concurrency)
+        api = AsyncReadAPI(current_app._get_current_object())  # pylint: disable=protected-access
+        async_ = asyncio.run(_async_throughput(api, path, total, concurrency))
+        click.echo(
+            f"{path} x{total}, {concurrency} concurrent: sync {sync:.0f} req/s, "
+            f"async {async_:.0f} req/s ({async_ / sync:.1f}x)"
+        )
+    finally:
+        _delete_employes(ids)
+
+
+def _sync_throughput(path, total, concurrency):
+    """Returns the requests per second of the Flask app on a pool of threads"""
+    flask_app = current_app._get_current_object()  # pylint: disable=protected-access
+
+    def read(_):
+        response = flask_app.test_client().get(path)
+        if response.status_code != 200:
+            raise click.ClickException(f"GET {path} answered {response.status_code}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(read, range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def _async_throughput(api, path, total, concurrency):
+    """Returns the requests per second of the async read API on one event loop"""
+    from service.asgi import fetch  # pylint: disable=import-outside-toplevel
+
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def read():
+        async with in_flight:
+            status_code, _, _ = await fetch(api, path)
+        if status_code != 200:
+            raise click.ClickException(f"GET {path} answered {status_code}")
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(read() for _ in range(total)))
+    finally:
+        await api.dispose()
+    return total / (time.perf_counter() - start)
+
+
+def _insert_employes(count):
+    """Inserts count Employes with one Beneficiary each, returns their ids"""
+    first = (db.session.query(func.max(Employed.id)).scalar() or 0) + 1
+    ids = list(range(first, first + count))
+    db.session.execute(Employed.__table__.insert(), [
+        {"id": i, "name": f"Employe {i}", "job_position": "Engineer", "salary": Decimal("1234.50"),
+         "status": "true", "date_hire": date(2020, 1, 1), "version": 1}
+        for i in ids
+    ])
+    db.session.execute(Beneficiary.__table__.insert(), [
+        {"name": f"Beneficiary {i}", "relationship": "child", "gender": "F",
+         "date_born": date(2010, 1, 1), "employed_id": i, "version": 1}
+        for i in ids
+    ])
+    db.session.commit()
+    return ids
+
+
+def _best_of(repeat, read):
+    """Returns the best time of the reads, each in a new session"""
+    times = []
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        read()
+        times.append(time.perf_counter() - start)
+    db.session.remove()
+    return min(times)
+
+
+def _delete_employes(ids):
+    """Deletes the benchmark Employes and their Beneficiaries"""
+    Beneficiary.query.filter(Beneficiary.employed_id.in_(ids)).delete(synchronize_session=False)
+    Employed.query.filter(Employed.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
@@ -0,0 +1,155 @@
+"""
+Response compression
+
+The JSON responses are compressed with the best encoding the client
+accepts among COMPRESS_ALGORITHMS. Responses smaller than
+COMPRESS_MIN_SIZE are sent as they are, so the small ones like /health
+do not pay for it, and streamed responses are compressed chunk by chunk
+as they are sent. A compressed response is another representation of the
+document, its ETag gets the encoding as suffix ("<etag>-gzip", "<etag>-br")
+so caches never mix them up. The routes compare the If-None-Match and
+If-Match headers with matching_etag, which ignores the suffix.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+ENCODINGS = ("gzip", "br")
+
+
+class GzipCompressor:
+    """Compresses a stream in the gzip format"""
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Returns the compressed data ready to be sent, maybe empty"""
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Returns the end of the stream"""
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    """Compresses a stream in the brotli format"""
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        """Returns the compressed data ready to be sent, maybe empty"""
+        return self._compressor.process(data)
+
+    def flush(self):
+        """Returns the end of the stream"""
+        return self._compressor.finish()
+
+
+class Compression:
+    """Compresses the responses of an app after every request"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, algorithms, min_size=1024, level=6, br_level=4, mimetypes=()):
+        self.algorithms = [a for a in algorithms if a != "br" or brotli is not None]
+        self.min_size = min_size
+        self.levels = {"gzip": level, "br": br_level}
+        self.mimetypes = set(mimetypes)
+
+    def compressor(self, encoding):
+        """Returns a new compressor for the encoding"""
+        if encoding == "br":
+            return BrotliCompressor(self.levels["br"])
+        return GzipCompressor(self.levels["gzip"])
+
+    def negotiate(self, request):
+        """Returns the preferred encoding accepted by the request, or None"""
+        return request.accept_encodings.best_match(self.algorithms)
+
+    def compress_response(self, request, response):
+        """Compresses the response if it is worth it and the client accepts it"""
+        if (
+            response.mimetype not in self.mimetypes
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        if not response.is_streamed and response.calculate_content_length() < self.min_size:
+            return response
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return response
+        compressor = self.compressor(encoding)
+        if response.is_streamed:
+            chunks = response.iter_encoded()
+            response.response = self._stream(compressor, chunks, response.response)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    @staticmethod
+    def _stream(compressor, chunks, iterable):
+        """Compresses the chunks of a streamed response as they are produced"""
+        try:
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def identity_etag(etag):
+    """Returns the ETag of the uncompressed response from the ETag of any encoding"""
+    for encoding in ENCODINGS:
+        if etag.endswith(f"-{encoding}"):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def matching_etag(etags, etag, weak=True):
+    """
+    Returns the tag of an If-None-Match or If-Match header matching an ETag in any encoding
+
+    Args:
+        etags (ETags): the parsed header
+        etag (str): the ETag of the uncompressed response
+        weak (bool): False for the strong comparison of If-Match
+    """
+    if etags.star_tag:
+        return etag
+    for tag in etags.as_set(include_weak=weak):
+        if identity_etag(tag) == etag:
+            return tag
+    return None
+
+
+def init_compression(app):
+    """Compresses the responses of the app as configured"""
+    algorithms = [a.strip() for a in app.config["COMPRESS_ALGORITHMS"].split(",") if a.strip()]
+    compression = Compression(
+        algorithms,
+        min_size=app.config["COMPRESS_MIN_SIZE"],
+        level=app.config["COMPRESS_LEVEL"],
+        br_level=app.config["COMPRESS_BR_LEVEL"],
+        mimetypes=app.config["COMPRESS_MIMETYPES"].split(","),
+    )
+    if compression.algorithms:
+        app.after_request(lambda response: compression.compress_response(request, response))
+    app.logger.info("Compressing responses with %s", ", ".join(compression.algorithms) or "nothing")
+    return compression
@@ -1,26 +1,47 @@
 """
 Module: error_handlers
 """
-from flask import jsonify
-from service.models import DataValidationError
-from service import app
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, db
 from . import status
 
+# The handlers are registered on the app by create_app()
+errors = Blueprint("errors", __name__)
+
 
 ######################################################################
 # Error Handlers
 ######################################################################
-@app.errorhandler(DataValidationError)
+@errors.app_errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
-    return bad_request(error)
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_400_BAD_REQUEST,
+            error="Bad Request",
+            message=message,
+            errors=error.errors,
+        ),
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+@errors.app_errorhandler(StaleDataError)
+def stale_data_error(error):
+    """Handles concurrent updates of the same record"""
+    db.session.rollback()
+    current_app.logger.warning(str(error))
+    return precondition_failed("The resource was modified by another request")
 
 
-@app.errorhandler(status.HTTP_400_BAD_REQUEST)
+@errors.app_errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(
             status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
@@ -29,22 +50,22 @@ def bad_request(error):
     )
 
 
-@app.errorhandler(status.HTTP_404_NOT_FOUND)
+@errors.app_errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(status=status.HTTP_404_NOT_FOUND, error="Not Found", message=message),
         status.HTTP_404_NOT_FOUND,
     )
 
 
-@app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
+@errors.app_errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
 def method_not_supported(error):
     """Handles unsupported HTTP methods with 405_METHOD_NOT_SUPPORTED"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(
             status=status.HTTP_405_METHOD_NOT_ALLOWED,
@@ -55,11 +76,41 @@ def method_not_supported(error):
     )
 
 
-@app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+@errors.app_errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed If-Match conditions with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
+@errors.app_errorhandler(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+def request_entity_too_large(error):
+    """Handles too large requests with 413_REQUEST_ENTITY_TOO_LARGE"""
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            error="Request Entity Too Large",
+            message=message,
+        ),
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
+@errors.app_errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(
             status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
@@ -70,11 +121,11 @@ def mediatype_not_supported(error):
     )
 
 
-@app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
+@errors.app_errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
     message = str(error)
-    app.logger.error(message)
+    current_app.logger.error(message)
     return (
         jsonify(
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,89 @@
+"""
+JSON encoding of the responses
+
+Flask 2.1 encodes jsonify and flask.json.dumps through app.json_encoder.
+These encoders write Decimal as strings, dates and datetimes in ISO 8601
+and compact separators unless an indent is asked for. The backend is
+selected with JSON_BACKEND: "orjson" encodes in C and falls back to the
+standard library for the output orjson cannot reproduce, "json" always
+uses the standard library. The responses are sent in UTF-8, JSON_AS_ASCII
+is off in the config.
+"""
+import re
+from datetime import date
+from decimal import Decimal
+from flask import json
+from service.common import timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+
+def _escape_non_ascii(match):
+    """Returns the \\uXXXX escape of a character, as a surrogate pair beyond the BMP"""
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return f"\\u{0xD800 | code >> 10:04x}\\u{0xDC00 | code & 0x3FF:04x}"
+    return f"\\u{code:04x}"
+
+
+class JSONEncoder(json.JSONEncoder):
+    """Encodes Decimal, date and datetime, compact by default"""
+
+    def __init__(self, *, separators=None, indent=None, **kwargs):
+        if separators is None and indent is None:
+            separators = (",", ":")
+        super().__init__(separators=separators, indent=indent, **kwargs)
+
+    def encode(self, o):
+        with timing.timed("json"):
+            return self._encode(o)
+
+    def _encode(self, o):
+        return super().encode(o)
+
+    def default(self, o):
+        if isinstance(o, date):  # datetime included
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return str(o)
+        return super().default(o)
+
+
+class OrjsonEncoder(JSONEncoder):
+    """
+    Encodes with orjson the output it writes exactly like JSONEncoder
+
+    orjson only writes compact output, so indented documents are encoded
+    by the standard library, and so are the ones it refuses (integers over
+    64 bits, circular references). When ensure_ascii is set the non ASCII
+    characters of the orjson output, which can only be in its strings, are
+    escaped like the standard library does.
+    """
+
+    def _encode(self, o):
+        if self.indent is not None or (self.item_separator, self.key_separator) != (",", ":"):
+            return super()._encode(o)
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        try:
+            result = orjson.dumps(o, default=self.default, option=option).decode("utf-8")
+        except orjson.JSONEncodeError:
+            return super()._encode(o)
+        if self.ensure_ascii and not result.isascii():
+            return NON_ASCII.sub(_escape_non_ascii, result)
+        return result
+
+
+def init_json(app):
+    """Sets the JSON encoder selected by JSON_BACKEND"""
+    backend = app.config["JSON_BACKEND"]
+    if backend == "orjson" and orjson is None:
+        app.logger.warning("orjson is not installed, using the json standard library")
+        backend = "json"
+    app.json_encoder = OrjsonEncoder if backend == "orjson" else JSONEncoder
+    app.logger.info("Using %s JSON encoder", backend)
@@ -0,0 +1,181 @@
+"""
+Prometheus metrics
+
+The requests, the SQL statements, the photo storage calls and the database
+pool are recorded with prometheus_client and exposed at /metrics in the
+Prometheus text format.
+
+Under gunicorn every worker records its own metrics. Set
+PROMETHEUS_MULTIPROC_DIR in the environment of gunicorn to add them up:
+the workers write their values in memory mapped files of that directory
+and /metrics reads the files of all the workers. The gauges only show the
+running workers, with a pid label. The master empties the directory when
+it starts and, when a worker exits, forgets its gauges and folds its
+counters and histograms into one file of the exited workers, so the
+directory does not grow with every worker, see gunicorn.conf.py.
+"""
+import glob
+import os
+import time
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.mmap_dict import MmapedDict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service.common import timing
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# the counters and histograms of the exited workers, see worker_exited
+EXITED = "exited"
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Duration of the HTTP requests, _count is the number of requests",
+    ("method", "route", "status"),
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Duration of the SQL statements, _count is the number of statements",
+    ("operation",),
+)
+STORAGE_SECONDS = Histogram(
+    "storage_operation_duration_seconds",
+    "Duration of the photo storage calls",
+    ("operation",),
+)
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_duration_seconds",
+    "Time waited to check out a database connection, ping included",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_EVENTS = Counter(
+    "db_pool_events",
+    "Checkout timeouts, overflow connections and invalidated connections of the database pool",
+    ("event",),
+)
+REPLICA_EVENTS = Counter(
+    "db_replica_events",
+    "Replicas found down and reads sent to the primary because every replica was down",
+    ("event",),
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections of the database pool by state, as of the last request of the worker",
+    ("state",),
+    multiprocess_mode="liveall",
+)
+
+
+######################################################################
+#  M U L T I P R O C E S S
+######################################################################
+def multiprocess_dir():
+    """Returns the directory shared by the workers, None when every process keeps its own metrics"""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+
+def render():
+    """Returns the metrics of all the workers in the Prometheus text format"""
+    registry = REGISTRY
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def clean_directory():
+    """Removes the metrics of the last run from the shared directory, before the workers start"""
+    directory = multiprocess_dir()
+    if directory is None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(path)
+
+
+def worker_exited(pid):
+    """Forgets the gauges of an exited worker and folds its counters and histograms"""
+    directory = multiprocess_dir()
+    if directory is None:
+        return
+    multiprocess.mark_process_dead(pid, directory)
+    for kind in ("counter", "histogram"):
+        path = os.path.join(directory, f"{kind}_{pid}.db")
+        if not os.path.exists(path):
+            continue
+        exited = MmapedDict(os.path.join(directory, f"{kind}_{EXITED}.db"))
+        try:
+            for key, value, _ in MmapedDict.read_all_values_from_file(path):
+                exited.write_value(key, exited.read_value(key) + value)
+        finally:
+            exited.close()
+        os.remove(path)
+
+
+######################################################################
+#  I N S T R U M E N T A T I O N
+######################################################################
+def _before_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+    start = conn.info["query_start"].pop()
+    duration = time.perf_counter() - start
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_SECONDS.labels(operation).observe(duration)
+    timing.record("db", duration, statement)
+
+
+def _handle_error(context):
+    """Forgets the start of a failed statement"""
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def pool_gauges(engine):
+    """Returns a callback setting the connection counts of the pool of an engine"""
+    def update():
+        pool = engine().pool
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, state):
+                POOL_CONNECTIONS.labels(state).set(getattr(pool, state)())
+    return update
+
+
+def init_metrics(app, engine):
+    """
+    Records the requests, the SQL statements and the pool of the app
+
+    Args:
+        engine (callable): returns the SQLAlchemy engine of the pool gauges
+    """
+    update_pool_gauges = pool_gauges(engine)
+    for name, listener in (
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+        ("handle_error", _handle_error),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        update_pool_gauges()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    app.logger.info("Metrics shared in %s", multiprocess_dir() or "this process only")
@@ -0,0 +1,83 @@
+"""
+Database connection pool
+
+The engine options come from the DB_POOL_* settings. DB_POOL_MODE "queue"
+keeps a pool of DB_POOL_SIZE connections in every worker, sized for its
+threads, that pings them on checkout and recycles them, so the workers
+recover from a database restart. DB_POOL_MODE "null" opens a connection
+per checkout and leaves the pooling to an external pooler like PgBouncer,
+the service keeps no session state on the connections so the transaction
+pooling mode is safe.
+
+The pools record the checkout waits, the timeouts, the overflow
+connections and the invalidated connections in the metrics.
+"""
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+from service.common import metrics
+
+
+class InstrumentedPool:
+    """Times the checkouts of a pool"""
+
+    def connect(self):
+        """Checks out a connection, recording the wait and the timeouts"""
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            metrics.POOL_EVENTS.labels("timeout").inc()
+            raise
+        finally:
+            metrics.POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    """A QueuePool counting the connections opened over its size"""
+
+    def _inc_overflow(self):
+        incremented = super()._inc_overflow()
+        if incremented and self._overflow > 0:
+            metrics.POOL_EVENTS.labels("overflow").inc()
+        return incremented
+
+
+class InstrumentedNullPool(InstrumentedPool, NullPool):
+    """A NullPool recording the time to open the connections"""
+
+
+def engine_options(config):
+    """Returns the SQLAlchemy engine options of the DB_POOL_* settings"""
+    if config["DB_POOL_MODE"] == "null":
+        return {"poolclass": InstrumentedNullPool}
+    if config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        return {}  # SQLite picks the pool suited to a file or memory database
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_use_lifo": config["DB_POOL_USE_LIFO"],
+    }
+
+
+def _invalidated(dbapi_connection, connection_record, exception):  # pylint: disable=unused-argument
+    metrics.POOL_EVENTS.labels("invalidate").inc()
+
+
+def _soft_invalidated(dbapi_connection, connection_record, exception):  # pylint: disable=unused-argument
+    metrics.POOL_EVENTS.labels("soft_invalidate").inc()
+
+
+def init_pool(app):
+    """Sets the engine options of the app, the explicit SQLALCHEMY_ENGINE_OPTIONS win"""
+    options = engine_options(app.config)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+    for name, listener in (("invalidate", _invalidated), ("soft_invalidate", _soft_invalidated)):
+        if not event.contains(Pool, name, listener):
+            event.listen(Pool, name, listener)
+    app.logger.info("Using %s database pool", app.config["DB_POOL_MODE"])
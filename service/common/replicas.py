@@ -0,0 +1,157 @@
+"""
+Read replicas
+
+DATABASE_REPLICA_URIS lists the replicas of the primary database. The GET
+and HEAD requests read from one of them, picked in turn, while the other
+requests, and any flush, use the primary. A client keeps reading from the
+primary for REPLICA_STICKY_SECONDS after a successful write, through a
+cookie, so it reads its own writes despite the replication lag.
+
+The replica connection of a request is opened by its first query. A
+replica that cannot be reached, or loses its connection, is left out for
+REPLICA_RETRY_INTERVAL seconds and the request reads from the next one, or
+from the primary when they are all down.
+"""
+import itertools
+import logging
+import threading
+import time
+from flask import request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, exc, orm
+from service.common import metrics, pooling
+
+logger = logging.getLogger("flask.app")
+
+STICKY_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+ROUTER = None
+
+
+class ReplicaRouter:
+    """Hands out connections to the replicas in turn, skipping the ones that are down"""
+
+    def __init__(self, engines, retry_interval=30):
+        self.engines = list(engines)
+        self.retry_interval = retry_interval
+        self._turns = itertools.cycle(range(len(self.engines)))
+        self._down_until = {}
+        self._lock = threading.Lock()
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._handle_error)
+
+    def available(self):
+        """Returns the replicas that are up, starting with the next in turn"""
+        now = time.monotonic()
+        with self._lock:
+            turn = next(self._turns)
+            engines = self.engines[turn:] + self.engines[:turn]
+            return [engine for engine in engines if self._down_until.get(engine, 0) <= now]
+
+    def connect(self):
+        """Returns a connection to a replica, None when they are all down"""
+        for engine in self.available():
+            try:
+                return engine.connect()
+            except exc.DBAPIError as error:
+                self.mark_down(engine, error)
+        metrics.REPLICA_EVENTS.labels("fallback").inc()
+        return None
+
+    def mark_down(self, engine, error):
+        """Leaves a replica out for retry_interval seconds"""
+        now = time.monotonic()
+        with self._lock:
+            if self._down_until.get(engine, 0) > now:
+                return
+            self._down_until[engine] = now + self.retry_interval
+        metrics.REPLICA_EVENTS.labels("down").inc()
+        logger.warning("Replica %s is down for %ss: %s", engine.url.render_as_string(), self.retry_interval, error)
+
+    def dispose(self, close=True):
+        """Drops the connections of the replicas, see Engine.dispose"""
+        for engine in self.engines:
+            engine.dispose(close=close)
+
+    def _handle_error(self, context):
+        if context.is_disconnect and context.engine is not None:
+            self.mark_down(context.engine, context.original_exception)
+
+
+######################################################################
+#  S E S S I O N
+######################################################################
+class RoutingSession(SignallingSession):
+    """A session that reads from a replica when its info has read_replica set"""
+
+    def get_bind(self, mapper=None, clause=None):
+        """Returns the replica connection for the reads, the primary engine otherwise"""
+        if self.info.get("read_replica") and not (self._flushing or self.new or self.dirty or self.deleted):
+            if "replica_connection" not in self.info:
+                self.info["replica_connection"] = ROUTER.connect() if ROUTER is not None else None
+            if self.info["replica_connection"] is not None:
+                return self.info["replica_connection"]
+        return super().get_bind(mapper, clause)
+
+    def close(self):
+        """Closes the session and returns its replica connection to the pool"""
+        super().close()
+        connection = self.info.pop("replica_connection", None)
+        if connection is not None:
+            connection.close()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that can read from the replicas"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def uses_replica(session):
+    """Returns True if the session read from a replica"""
+    return session.info.get("replica_connection") is not None
+
+
+def reads_own_writes():
+    """Returns True if the client of the request wrote less than REPLICA_STICKY_SECONDS ago"""
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def dispose_replicas(close=True):
+    """Drops the connections of the replicas, if any"""
+    if ROUTER is not None:
+        ROUTER.dispose(close=close)
+
+
+def init_replicas(app, session):
+    """Creates the replica engines and routes the reads of every request"""
+    global ROUTER  # pylint: disable=global-statement
+    uris = [uri.strip() for uri in app.config["DATABASE_REPLICA_URIS"].split(",") if uri.strip()]
+    ROUTER = None
+    if uris:
+        ROUTER = ReplicaRouter(
+            [create_engine(uri, **pooling.engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri)))
+             for uri in uris],
+            app.config["REPLICA_RETRY_INTERVAL"],
+        )
+    sticky = app.config["REPLICA_STICKY_SECONDS"]
+
+    @app.before_request
+    def _route_reads():
+        if ROUTER is not None and request.method in READ_METHODS and not reads_own_writes():
+            session.info["read_replica"] = True
+
+    @app.after_request
+    def _stick_to_primary(response):
+        if ROUTER is not None and request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, str(time.time() + sticky), max_age=sticky, httponly=True, samesite="Lax"
+            )
+        return response
+
+    app.logger.info("Reading from %s replicas", len(uris))
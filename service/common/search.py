@@ -0,0 +1,61 @@
+"""
+Trigram search
+
+Pure Python version of the pg_trgm similarity functions. PostgreSQL ranks
+the searches with the trigram indexes, the other databases (SQLite in the
+tests) fall back to these functions over the names.
+"""
+import re
+
+# pg_trgm defaults
+SIMILARITY_THRESHOLD = 0.3
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def words(text):
+    """Returns the lowercase alphanumeric words of a text"""
+    return WORD.findall(text.lower())
+
+
+def trigrams(text):
+    """Returns the set of trigrams of a text, every word padded like pg_trgm"""
+    result = set()
+    for word in words(text):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(first, second):
+    """Returns the share of trigrams two texts have in common"""
+    first, second = trigrams(first), trigrams(second)
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def word_similarity(query, text):
+    """Returns the share of the query trigrams found in the best run of words of the text"""
+    query_trigrams = trigrams(query)
+    if not query_trigrams:
+        return 0.0
+    text_words = words(text)
+    size = min(len(words(query)), len(text_words))
+    best = 0.0
+    for start in range(len(text_words) - size + 1):
+        extent = trigrams(" ".join(text_words[start:start + size]))
+        best = max(best, len(query_trigrams & extent) / len(query_trigrams))
+    return best
+
+
+def score(query, text):
+    """Returns the rank of a text for a query, 0 when it does not match"""
+    if not text:
+        return 0.0
+    full = similarity(query, text)
+    partial = word_similarity(query, text)
+    if full < SIMILARITY_THRESHOLD and partial < WORD_SIMILARITY_THRESHOLD:
+        return 0.0
+    return max(full, partial)
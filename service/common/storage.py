@@ -0,0 +1,236 @@
+"""
+Photo storage backends
+
+The photos are stored through one of these backends, selected with the
+STORAGE_BACKEND setting: "s3" for the object storage, "local" for a
+directory on disk and "memory" for tests and offline benchmarks.
+"""
+import logging
+import os
+import threading
+from urllib.parse import quote
+
+logger = logging.getLogger("flask.app")
+
+STORAGE = None
+
+
+class StorageError(Exception):
+    """Used for invalid keys or misconfigured backends"""
+
+
+class S3Storage:
+    """Stores the photos in an S3 compatible bucket"""
+
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+    def __init__(self, bucket, public_url, endpoint_url=None, region_name=None,
+                 access_key_id=None, secret_access_key=None, max_pool_connections=10,
+                 connect_timeout=5, read_timeout=10, max_attempts=3):
+        self.bucket = bucket
+        self.public_url = public_url
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.max_pool_connections = max_pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Returns the boto3 client of this process
+
+        The client is created on first use and again after a fork, so
+        importing the service does not pay for boto3 and every worker gets
+        its own connection pool.
+        """
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = self._create_client()
+                    self._pid = pid
+        return self._client
+
+    def warm(self):
+        """Creates the client of this process before its first request"""
+        return self.client
+
+    def _create_client(self):
+        """Creates a boto3 client with the configured pool and timeouts"""
+        # pylint: disable=import-outside-toplevel
+        import boto3
+        from botocore.config import Config
+
+        logger.info("Creating S3 client with %s pooled connections", self.max_pool_connections)
+        session = boto3.session.Session()
+        return session.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name=self.region_name,
+            aws_access_key_id=self.access_key_id,
+            aws_secret_access_key=self.secret_access_key,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                retries={"max_attempts": self.max_attempts},
+            ),
+        )
+
+    def exists(self, key):
+        """Returns True if the key is stored in the bucket"""
+        # pylint: disable=import-outside-toplevel
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return False
+        return True
+
+    def put(self, key, body, content_type):
+        """Stores a public object"""
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ACL="public-read",
+            ContentType=content_type,
+        )
+
+    def presign_post(self, key, content_type, max_size, expires_in):
+        """
+        Returns the url and the form fields of a presigned POST of the object
+
+        The policy pins the key, the content type and the ACL, and S3 refuses
+        a file larger than max_size bytes.
+        """
+        post = self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type, "acl": "public-read"},
+            Conditions=[
+                {"Content-Type": content_type},
+                {"acl": "public-read"},
+                ["content-length-range", 1, max_size],
+            ],
+            ExpiresIn=expires_in,
+        )
+        return post["url"], post["fields"]
+
+    def url(self, key):
+        """Returns the public url of a key"""
+        return self.public_url + key
+
+
+class LocalStorage:
+    """Stores the photos in a directory"""
+
+    def __init__(self, root, public_url):
+        self.root = os.path.abspath(root)
+        self.public_url = public_url
+
+    def _path(self, key):
+        """Returns the path of a key, refusing keys outside of the root"""
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise StorageError(f"Invalid key: {key}")
+        return path
+
+    def exists(self, key):
+        """Returns True if the key is stored in the directory"""
+        try:
+            return os.path.isfile(self._path(key))
+        except StorageError:
+            return False
+
+    def put(self, key, body, content_type):  # pylint: disable=unused-argument
+        """Writes the object to disk"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as stream:
+            stream.write(body)
+
+    def presign_post(self, key, content_type, max_size, expires_in):  # pylint: disable=unused-argument
+        """Returns the file url where the object must be written, with no form fields"""
+        return "file://" + quote(self._path(key)), {}
+
+    def url(self, key):
+        """Returns the public url of a key"""
+        return self.public_url + key
+
+    def warm(self):
+        """Nothing to prepare"""
+
+
+class MemoryStorage:
+    """Keeps the photos in a dictionary, for tests and benchmarks"""
+
+    def __init__(self, public_url="memory://"):
+        self.public_url = public_url
+        self.objects = {}
+
+    def exists(self, key):
+        """Returns True if the key is stored"""
+        return key in self.objects
+
+    def put(self, key, body, content_type):
+        """Stores the object"""
+        self.objects[key] = (body, content_type)
+
+    def presign_post(self, key, content_type, max_size, expires_in):  # pylint: disable=unused-argument
+        """Returns a fake upload url for the key and its form fields"""
+        return "memory://" + key, {"key": key, "Content-Type": content_type}
+
+    def url(self, key):
+        """Returns the public url of a key"""
+        return self.public_url + key
+
+    def warm(self):
+        """Nothing to prepare"""
+
+
+def create_storage(config):
+    """Builds the backend selected by STORAGE_BACKEND"""
+    backend = config["STORAGE_BACKEND"]
+    public_url = config["STORAGE_PUBLIC_URL"]
+    if backend == "s3":
+        if not config["S3_ACCESS_KEY_ID"] or not config["S3_SECRET_ACCESS_KEY"]:
+            raise StorageError("The s3 storage needs S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY")
+        return S3Storage(
+            bucket=config["STORAGE_BUCKET"],
+            public_url=public_url,
+            endpoint_url=config["S3_ENDPOINT_URL"],
+            region_name=config["S3_REGION"],
+            access_key_id=config["S3_ACCESS_KEY_ID"],
+            secret_access_key=config["S3_SECRET_ACCESS_KEY"],
+            max_pool_connections=config["S3_MAX_POOL_CONNECTIONS"],
+            connect_timeout=config["S3_CONNECT_TIMEOUT"],
+            read_timeout=config["S3_READ_TIMEOUT"],
+            max_attempts=config["S3_MAX_ATTEMPTS"],
+        )
+    if backend == "local":
+        return LocalStorage(config["STORAGE_LOCAL_ROOT"], public_url)
+    if backend == "memory":
+        return MemoryStorage(public_url)
+    raise StorageError(f"Unknown storage backend: {backend}")
+
+
+def init_storage(app):
+    """Initializes the storage backend of the app"""
+    global STORAGE  # pylint: disable=global-statement
+    STORAGE = create_storage(app.config)
+    app.logger.info("Using %s photo storage", app.config["STORAGE_BACKEND"])
+
+
+def get_storage():
+    """Returns the storage backend initialized by init_storage"""
+    if STORAGE is None:
+        raise StorageError("Storage was not initialized")
+    return STORAGE
@@ -0,0 +1,126 @@
+"""
+Request timing
+
+Every request collects the time it spent in the database, the photo
+storage and the JSON encoding, and reports it in a Server-Timing header,
+e.g. "db;dur=12.5;desc="4 queries", storage;dur=80.1, total;dur=95.3".
+The requests slower than SLOW_REQUEST_THRESHOLD seconds are also logged
+as a JSON entry with their SQL statements. Outside of a request, like in
+the background uploads, nothing is recorded.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+
+logger = logging.getLogger("flask.app")
+
+# Server-Timing descriptions of the timed steps
+DESCRIPTIONS = {
+    "db": "queries",
+    "storage": "storage calls",
+    "decode": "photo decodes",
+    "json": "encodings",
+}
+
+
+class RequestTimings:
+    """The time spent by a request in every step, with its SQL statements"""
+
+    def __init__(self, max_statements=100):
+        self.start = time.perf_counter()
+        self.max_statements = max_statements
+        self.steps = {}
+        self.statements = []
+        self.dropped_statements = 0
+
+    def add(self, step, duration, statement=None):
+        """Adds the duration of a step, and the statement it executed"""
+        total, count = self.steps.get(step, (0.0, 0))
+        self.steps[step] = (total + duration, count + 1)
+        if statement is not None:
+            if len(self.statements) < self.max_statements:
+                self.statements.append((statement, duration))
+            else:
+                self.dropped_statements += 1
+
+    def elapsed(self):
+        """Returns the seconds since the request started"""
+        return time.perf_counter() - self.start
+
+    def header(self, total):
+        """Returns the Server-Timing header value"""
+        metrics = []
+        for step, (duration, count) in self.steps.items():
+            description = DESCRIPTIONS.get(step, "calls")
+            metrics.append(f'{step};dur={duration * 1000:.1f};desc="{count} {description}"')
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def log_entry(self, response, total):
+        """Returns the structured slow request log entry"""
+        return {
+            "event": "slow_request",
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 1),
+            "steps": {
+                step: {"duration_ms": round(duration * 1000, 1), "count": count}
+                for step, (duration, count) in self.steps.items()
+            },
+            "statements": [
+                {"sql": statement, "duration_ms": round(duration * 1000, 1)}
+                for statement, duration in self.statements
+            ],
+            "dropped_statements": self.dropped_statements,
+        }
+
+
+def current():
+    """Returns the timings of the current request, None outside of a request"""
+    if not has_request_context():
+        return None
+    return g.get("timings")
+
+
+def record(step, duration, statement=None):
+    """Adds the duration of a step to the current request, if any"""
+    timings = current()
+    if timings is not None:
+        timings.add(step, duration, statement)
+
+
+@contextmanager
+def timed(step):
+    """Adds the duration of the block to a step of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(step, time.perf_counter() - start)
+
+
+def init_timing(app):
+    """Times the requests of the app, adding Server-Timing and logging the slow ones"""
+    threshold = app.config["SLOW_REQUEST_THRESHOLD"]
+    server_timing = app.config["SERVER_TIMING"]
+    max_statements = app.config["SLOW_REQUEST_MAX_STATEMENTS"]
+
+    @app.before_request
+    def start_timings():
+        g.timings = RequestTimings(max_statements)
+
+    @app.after_request
+    def report_timings(response):
+        timings = g.pop("timings", None)
+        if timings is None:
+            return response
+        total = timings.elapsed()
+        if server_timing:
+            response.headers["Server-Timing"] = timings.header(total)
+        if threshold and total >= threshold:
+            logger.warning(json.dumps(timings.log_entry(response, total)))
+        return response
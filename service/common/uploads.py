@@ -0,0 +1,197 @@
+"""
+Background photo uploads
+
+This module moves the photo uploads off the request thread. The routes
+store the Employe with photo_status "pending" and enqueue the image, a
+bounded pool of threads uploads it and updates the row with the final url.
+
+Every enqueued upload gets a job token, stored in the row. The result is
+only saved while the row still holds the token: a photo changed by a later
+request replaces it, and the older upload is dropped and counted as
+superseded.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from flask import current_app
+from service.common import cache, util
+
+logger = logging.getLogger("flask.app")
+
+PHOTO_PENDING = "pending"
+PHOTO_READY = "ready"
+PHOTO_FAILED = "failed"
+
+_LOCK = threading.Lock()
+
+
+class UploadQueue:
+    """A bounded queue of photo uploads served by a pool of threads"""
+
+    def __init__(self, app, workers=4, max_size=100, retries=3, backoff=0.5):
+        self.app = app
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "retried": 0, "superseded": 0}
+
+    def submit(self, employe_id, img, name, job):
+        """
+        Enqueues the upload of an Employe photo
+
+        Args:
+            job (str): the photo_job token of the saved Employe, see mark_pending
+
+        Returns:
+            False if the queue is full or closed and the caller must upload
+            the photo itself
+        """
+        if self._closed:
+            return False
+        self._start()
+        try:
+            self._queue.put_nowait((employe_id, img, name, job))
+        except queue.Full:
+            logger.warning("Photo upload queue is full, uploading %s inline", name)
+            return False
+        self._count("submitted")
+        return True
+
+    def drain(self, timeout=None):
+        """
+        Stops accepting uploads and waits for the queued ones to finish
+
+        Returns:
+            False if the timeout ran out before every worker finished
+        """
+        with self._lock:
+            if self._closed:
+                return True
+            self._closed = True
+            threads = list(self._threads)
+        logger.info("Draining %s queued photo uploads", self._queue.qsize())
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+        for _ in threads:
+            try:
+                self._queue.put(None, timeout=remaining())
+            except queue.Full:
+                logger.warning("Photo upload queue still full after %ss, %s uploads dropped",
+                               timeout, self._queue.qsize())
+                return False
+        for thread in threads:
+            thread.join(remaining())
+        if any(thread.is_alive() for thread in threads):
+            logger.warning("Photo uploads still running after %ss", timeout)
+            return False
+        return True
+
+    def metrics(self):
+        """Returns the queue depth and the upload counters"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["depth"] = self._queue.qsize()
+        counters["workers"] = len(self._threads)
+        return counters
+
+    def _start(self):
+        """Starts the worker threads on first use"""
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"photo-upload-{number}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _work(self):
+        """Serves uploads until a None sentinel is received"""
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._process(*job)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Unexpected error processing photo upload")
+            finally:
+                self._queue.task_done()
+
+    def _process(self, employe_id, img, name, job):
+        """Uploads one photo with retries and stores the result"""
+        url = None
+        for attempt in range(self.retries + 1):
+            try:
+                url = util.upload_img(img, name)
+                break
+            except Exception as error:  # pylint: disable=broad-except
+                if attempt == self.retries:
+                    logger.error("Photo upload of %s failed: %s", name, error)
+                    break
+                self._count("retried")
+                time.sleep(self.backoff * 2**attempt)
+        if not self._save(employe_id, job, url):
+            logger.warning("Employe [%s] was removed or got another photo before its upload finished", employe_id)
+            self._count("superseded")
+            return
+        self._count("completed" if url is not None else "failed")
+
+    def _save(self, employe_id, job, url):
+        """Updates the Employe with the uploaded photo url, returns False if the job was superseded"""
+        # pylint: disable=import-outside-toplevel, cyclic-import
+        from service.models import Employed
+
+        with self.app.app_context():
+            saved = Employed.save_photo(employe_id, job, url, PHOTO_FAILED if url is None else PHOTO_READY)
+        if saved:
+            cache.get_cache().invalidate([employe_id])
+        return saved
+
+
+def mark_pending(employe):
+    """Marks the photo of an Employe as pending for a new upload job"""
+    employe.photo_status = PHOTO_PENDING
+    employe.photo_job = uuid.uuid4().hex
+
+
+def mark_ready(employe):
+    """Marks the photo of an Employe as stored, superseding any pending upload"""
+    employe.photo_status = PHOTO_READY
+    employe.photo_job = None
+
+
+def get_upload_queue(app=None):
+    """Returns the UploadQueue of the app, the current one by default, None if async uploads are disabled"""
+    if app is None:
+        app = current_app._get_current_object()  # pylint: disable=protected-access
+    if not app.config.get("PHOTO_UPLOAD_ASYNC"):
+        return None
+    with _LOCK:
+        upload_queue = app.extensions.get("photo_uploads")
+        if upload_queue is None:
+            upload_queue = UploadQueue(
+                app,
+                workers=app.config["PHOTO_UPLOAD_WORKERS"],
+                max_size=app.config["PHOTO_UPLOAD_QUEUE_SIZE"],
+                retries=app.config["PHOTO_UPLOAD_RETRIES"],
+                backoff=app.config["PHOTO_UPLOAD_BACKOFF"],
+            )
+            app.extensions["photo_uploads"] = upload_queue
+            atexit.register(upload_queue.drain, app.config["PHOTO_UPLOAD_DRAIN_TIMEOUT"])
+    return upload_queue
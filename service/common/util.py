@@ -1,27 +1,151 @@
 
-import boto3
 import base64
+import binascii
+import hashlib
+import json
+import logging
 import re
+import threading
+import uuid
+from collections import OrderedDict
+from service.common import metrics, storage, timing
 
-# Instance for s3 digitaloceanspaces
-#!! NOTE: I am using harcode keys becouse it is just to test. The idea is use SECRETS for kubernetes or something else
-session = boto3.session.Session()
-CLIENT = session.client("s3",
-            endpoint_url='https://evaluacion-ksp.sfo3.digitaloceanspaces.com', # Find your endpoint in the control panel, under Settings. Prepend "https://".
-            region_name='sfo3', # Use the region in your endpoint.
-            aws_access_key_id='DO00NH3W77NKD94LR9J3', # Access key pair. You can create access key pairs using the control panel or API.
-            aws_secret_access_key='2ALvqRtVqN/cxGW/srCh3TpxmCx4sbB6indXWfOVeS8' # Secret access key defined through an environment variable.
-)
+logger = logging.getLogger("flask.app")
+
+# Content types accepted for the photos
+IMAGE_TYPES = {
+    "image/png": "png",
+    "image/jpeg": "jpeg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+# Prefix and random name of the keys issued by presign_upload
+UPLOADS_PREFIX = "uploads/"
+UPLOAD_NAME = re.compile(r"^[0-9a-f]{32}$")
+
+
+# Keys already stored in the bucket, so the same image is never sent twice
+KNOWN_KEYS_SIZE = 1024
+
+
+class LRUSet:
+    """A thread safe set that forgets its least recently used keys"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        """Adds a key, evicting the least recently used one when full"""
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        """Forgets all the keys"""
+        with self._lock:
+            self._keys.clear()
+
+
+KNOWN_KEYS = LRUSet(KNOWN_KEYS_SIZE)
+
+
+def object_exists(key):
+    """Checks if a key is already stored, asking the storage on a cache miss"""
+    if key in KNOWN_KEYS:
+        return True
+    with metrics.STORAGE_SECONDS.labels("exists").time(), timing.timed("storage"):
+        exists = storage.get_storage().exists(key)
+    if not exists:
+        return False
+    KNOWN_KEYS.add(key)
+    return True
 
 
 def upload_img(img, name):
-    typee = re.search("image/[a-z]*", img)
-    img = re.sub(r"^data:image/.*,","",img)
-    name = name+"."+typee.group().split("/")[1]
-    res = CLIENT.put_object(Bucket="evaluacion-ksp",
-                  Key=name, # Object key, referenced whenever you want to access this file later.
-                  Body=base64.b64decode(img), # The object's contents.
-                  ACL='public-read', # Defines Access-control List (ACL) permissions, such as private or public.
-                  ContentType=typee.group()
-                )
-    return "https://evaluacion-ksp.sfo3.digitaloceanspaces.com/evaluacion-ksp/"+name
\ No newline at end of file
+    """
+    Uploads a base64 data uri image and returns its public url
+
+    The key is the sha256 of the image bytes, so the same image is stored
+    once no matter how many Employes use it.
+    """
+    with timing.timed("decode"):
+        typee = re.search("image/[a-z]*", img)
+        img = re.sub(r"^data:image/.*,","",img)
+        body = base64.b64decode(img)
+        key = hashlib.sha256(body).hexdigest()+"."+typee.group().split("/")[1]
+    if object_exists(key):
+        logger.info("Photo of %s already stored as %s", name, key)
+    else:
+        with metrics.STORAGE_SECONDS.labels("put").time(), timing.timed("storage"):
+            storage.get_storage().put(key, body, typee.group())
+        KNOWN_KEYS.add(key)
+    return photo_url(key)
+
+
+def photo_url(key):
+    """Returns the public url of a stored photo"""
+    return storage.get_storage().url(key)
+
+
+def presign_upload(content_type, max_size=5 * 1024 * 1024, expires_in=900):
+    """
+    Builds a presigned POST to upload a photo straight into the bucket
+
+    Returns:
+        a (key, url, fields) tuple, the client must POST a multipart form
+        with the fields followed by the image as the file field, of at most
+        max_size bytes
+
+    Raises:
+        ValueError: if the content type is not an accepted image type
+    """
+    if content_type not in IMAGE_TYPES:
+        raise ValueError(f"Unsupported photo type: {content_type}")
+    key = f"{UPLOADS_PREFIX}{uuid.uuid4().hex}.{IMAGE_TYPES[content_type]}"
+    url, fields = storage.get_storage().presign_post(key, content_type, max_size, expires_in)
+    return key, url, fields
+
+
+def is_upload_key(key):
+    """Returns True if the key has the form of the keys issued by presign_upload"""
+    if not isinstance(key, str) or not key.startswith(UPLOADS_PREFIX):
+        return False
+    name, _, extension = key[len(UPLOADS_PREFIX):].rpartition(".")
+    return bool(UPLOAD_NAME.match(name)) and extension in IMAGE_TYPES.values()
+
+
+def encode_cursor(last_id):
+    """Builds an opaque pagination cursor from the last id of a page"""
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns the id stored in a cursor built with encode_cursor
+
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+    if not isinstance(last_id, int):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return last_id
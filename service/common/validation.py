@@ -0,0 +1,172 @@
+"""
+Payload validation
+
+The request bodies are checked against these schemas before the routes do
+any storage or database work. Every schema is compiled once into a list of
+checks so a validation only walks the fields, and all the field errors are
+reported together.
+"""
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from service.models import DataValidationError
+
+DATA_URI = re.compile(r"^data:(image/(?:png|jpeg|gif|webp));base64,[A-Za-z0-9+/=\s]*$")
+
+# Numeric(precision=10, scale=2)
+MAX_SALARY = Decimal("99999999.99")
+
+
+######################################################################
+#  F I E L D   C H E C K S
+######################################################################
+def is_data_uri(value):
+    """Returns True if the value is an inline base64 image"""
+    return isinstance(value, str) and value.startswith("data:")
+
+
+def string(max_length):
+    """Checks a string of at most max_length characters"""
+    def check(value):
+        if not isinstance(value, str):
+            return "must be a string"
+        if len(value) > max_length:
+            return f"must be at most {max_length} characters"
+        return None
+    return check
+
+
+def salary(value):
+    """Checks a number that fits in the salary column"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return "must be a number"
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        return "must be a number"
+    if not number.is_finite() or abs(number) > MAX_SALARY:
+        return f"must be a number up to {MAX_SALARY}"
+    return None
+
+
+def iso_date(value):
+    """Checks an ISO 8601 date (YYYY-MM-DD)"""
+    if not isinstance(value, str):
+        return "must be a date string"
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return "must be a date in YYYY-MM-DD format"
+    return None
+
+
+def status_flag(value):
+    """Checks an Employe status, a string or a boolean"""
+    if isinstance(value, bool):
+        return None
+    return string(64)(value)
+
+
+def photo(value):
+    """Checks an inline base64 image or a url"""
+    if is_data_uri(value):
+        if not DATA_URI.match(value):
+            return "must be a base64 png, jpeg, gif or webp data uri"
+        return None
+    return string(150)(value)
+
+
+def integer(value):
+    """Checks an integer"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        return "must be an integer"
+    return None
+
+
+######################################################################
+#  S C H E M A S
+######################################################################
+class Schema:
+    """
+    A compiled object schema
+
+    Args:
+        fields (dict): maps each field to a (check, required) tuple, a check
+            returns an error message or None. Unknown fields are ignored.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self._checks = tuple(
+            (field, check, required) for field, (check, required) in fields.items()
+        )
+
+    def errors(self, data, prefix=""):
+        """Returns the list of {field, message} errors of the data"""
+        if not isinstance(data, dict):
+            return [{"field": prefix.rstrip(".") or self.name, "message": "must be an object"}]
+        errors = []
+        for field, check, required in self._checks:
+            value = data.get(field)
+            if value is None:
+                if required:
+                    errors.append({"field": prefix + field, "message": "is required"})
+                continue
+            message = check(value)
+            if message:
+                errors.append({"field": prefix + field, "message": message})
+        return errors
+
+    def validate(self, data):
+        """Raises a DataValidationError with all the errors of the data"""
+        raise_for(self.name, self.errors(data))
+
+
+EMPLOYE = Schema("employe", {
+    "name": (string(64), True),
+    "job_position": (string(64), True),
+    "salary": (salary, True),
+    "status": (status_flag, False),
+    "date_hire": (iso_date, False),
+    "photo": (photo, False),
+    "photo_key": (string(150), False),
+})
+
+BENEFICIARY = Schema("beneficiary", {
+    "name": (string(64), True),
+    "relationship": (string(64), True),
+    "gender": (string(64), True),
+    "date_born": (iso_date, False),
+    "employed_id": (integer, False),
+})
+
+
+def document_errors(document):
+    """Returns the errors of a {employe, beneficiary} document"""
+    if not isinstance(document, dict):
+        return [{"field": "document", "message": "must be an object"}]
+    if document.get("employe") is None:
+        errors = [{"field": "employe", "message": "is required"}]
+    else:
+        errors = EMPLOYE.errors(document["employe"], "employe.")
+    beneficiaries = document.get("beneficiary")
+    if beneficiaries is None:
+        return errors
+    if not isinstance(beneficiaries, list):
+        errors.append({"field": "beneficiary", "message": "must be a list"})
+        return errors
+    for index, beneficiary in enumerate(beneficiaries):
+        errors.extend(BENEFICIARY.errors(beneficiary, f"beneficiary[{index}]."))
+    return errors
+
+
+def validate_document(document):
+    """Raises a DataValidationError with all the errors of a document"""
+    raise_for("document", document_errors(document))
+
+
+def raise_for(name, errors):
+    """Raises a DataValidationError listing the errors, if any"""
+    if errors:
+        fields = ", ".join(f"{e['field']} {e['message']}" for e in errors)
+        raise DataValidationError(f"Invalid {name}: {fields}", errors)
@@ -18,5 +18,114 @@ if not DATABASE_URI:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Create the missing tables when the app is created, the gunicorn config
+# turns it off in the workers and creates them once in the master
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "true").lower() == "true"
+
+# Connection pool of every worker: queue, or null behind an external pooler
+# like PgBouncer. Size the pool for the threads of a worker.
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "false").lower() == "true"
+# Connections opened by every gunicorn worker when it starts
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "1"))
+
+# Async driver of the read routes served by service.asgi, derived from
+# DATABASE_URI when not set (postgresql+asyncpg or sqlite+aiosqlite)
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI", "")
+# Threads of every ASGI worker running the other routes with the Flask app
+ASGI_SYNC_THREADS = int(os.getenv("ASGI_SYNC_THREADS", "8"))
+
+# Read replicas of DATABASE_URI, comma separated uris. The GET requests read
+# from them, the writes and the reads of a client for REPLICA_STICKY_SECONDS
+# after it wrote use the primary. A replica that is down is retried after
+# REPLICA_RETRY_INTERVAL seconds, meanwhile its reads go to the others.
+DATABASE_REPLICA_URIS = os.getenv("DATABASE_REPLICA_URIS", "")
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_RETRY_INTERVAL = float(os.getenv("REPLICA_RETRY_INTERVAL", "30"))
+
+# Strategy used to load relationships (selectin, joined, subquery or lazy)
+EAGER_LOADING_STRATEGY = os.getenv("EAGER_LOADING_STRATEGY", "selectin")
+
+# Keyset pagination of the list endpoints
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Results returned by GET /employe/search
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "20"))
+MAX_SEARCH_LIMIT = int(os.getenv("MAX_SEARCH_LIMIT", "100"))
+
+# Rows fetched per round trip by the streaming export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Maximum number of documents accepted by POST /employe/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Background photo uploads, disabled by default
+PHOTO_UPLOAD_ASYNC = os.getenv("PHOTO_UPLOAD_ASYNC", "false").lower() == "true"
+PHOTO_UPLOAD_WORKERS = int(os.getenv("PHOTO_UPLOAD_WORKERS", "4"))
+PHOTO_UPLOAD_QUEUE_SIZE = int(os.getenv("PHOTO_UPLOAD_QUEUE_SIZE", "100"))
+PHOTO_UPLOAD_RETRIES = int(os.getenv("PHOTO_UPLOAD_RETRIES", "3"))
+PHOTO_UPLOAD_BACKOFF = float(os.getenv("PHOTO_UPLOAD_BACKOFF", "0.5"))
+PHOTO_UPLOAD_DRAIN_TIMEOUT = float(os.getenv("PHOTO_UPLOAD_DRAIN_TIMEOUT", "30"))
+
+# Lifetime in seconds of the presigned photo upload urls
+PHOTO_PRESIGN_EXPIRES = int(os.getenv("PHOTO_PRESIGN_EXPIRES", "900"))
+# Largest photo in bytes accepted by the presigned uploads
+PHOTO_MAX_SIZE = int(os.getenv("PHOTO_MAX_SIZE", str(5 * 1024 * 1024)))
+
+# Photo storage backend: s3, local or memory. The local directory is the
+# default for development, production sets s3 and its keys
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "evaluacion-ksp")
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "photos")
+STORAGE_PUBLIC_URL = os.getenv(
+    "STORAGE_PUBLIC_URL",
+    "https://evaluacion-ksp.sfo3.digitaloceanspaces.com/evaluacion-ksp/" if STORAGE_BACKEND == "s3"
+    else f"file://{os.path.abspath(STORAGE_LOCAL_ROOT)}/",
+)
+
+# S3 client, created lazily by every worker process
+# The keys have no default, they must come from the secrets of the deployment
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "https://evaluacion-ksp.sfo3.digitaloceanspaces.com")
+S3_REGION = os.getenv("S3_REGION", "sfo3")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "10"))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "3"))
+
+# Cache of the GET /employe/<id> documents: memory, null or package.module:factory
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# JSON encoding of the responses: orjson, or json for the standard library
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson")
+# UTF-8 responses, escaping the accented names costs more than encoding them
+JSON_AS_ASCII = False
+
+# Compression of the responses negotiated with Accept-Encoding, in order of
+# preference, br is only used when the brotli package is installed
+COMPRESS_ALGORITHMS = os.getenv("COMPRESS_ALGORITHMS", "br,gzip")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BR_LEVEL = int(os.getenv("COMPRESS_BR_LEVEL", "4"))
+COMPRESS_MIMETYPES = os.getenv("COMPRESS_MIMETYPES", "application/json,application/x-ndjson")
+
+# Metrics exposed at /metrics: set PROMETHEUS_MULTIPROC_DIR in the environment
+# of gunicorn to add up its workers, it is read by prometheus_client on import
+
+# Server-Timing header and log of the requests slower than the threshold
+# in seconds, 0 disables the log
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "1.0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "100"))
@@ -3,31 +3,85 @@ Models for Account
 
 All of the models are stored in this module
 """
+import functools
+import hashlib
+import heapq
 import logging
+from contextlib import contextmanager
 from datetime import date
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, Date, DateTime, event, func, or_, select
+from sqlalchemy.orm import joinedload, lazyload, selectinload, subqueryload
+from service.common import replicas, search
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# The sessions read from the replicas in the read only requests, see replicas
+db = replicas.RoutingSQLAlchemy()
+
+
+# Loader options available to load the relationships of a model
+LOADING_STRATEGIES = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "subquery": subqueryload,
+    "lazy": lazyload,
+}
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        # list of {field, message} dictionaries
+        self.errors = errors or []
+
 
 def init_db(app):
     """Initialize the SQLAlchemy app"""
     Employed.init_db(app)
 
 
+@functools.lru_cache(maxsize=None)
+def row_serializer(columns, fields):
+    """
+    Returns a function that turns a Core row into a dictionary
+
+    The position of every field in the row, and whether it holds a date, is
+    looked up once for every (columns, fields) pair. Dates are formatted in
+    ISO 8601 like serialize() does and Numeric values keep the Decimal
+    returned by the column type.
+
+    Args:
+        columns (tuple): the selected Columns, in the order of the row
+        fields (tuple): the names of the columns to put in the dictionary
+    """
+    index = {column.key: position for position, column in enumerate(columns)}
+    plan = tuple(
+        (field, index[field], isinstance(columns[index[field]].type, (Date, DateTime))) for field in fields
+    )
+
+    def serialize(row):
+        result = {}
+        for field, position, is_date in plan:
+            value = row[position]
+            result[field] = value.isoformat() if is_date and value is not None else value
+        return result
+
+    return serialize
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
 class PersistentBase:
     """Base class added persistent methods"""
 
+    # Strategy used to load the relationships listed in eager_relationships
+    loading_strategy = "selectin"
+    eager_relationships = ()
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
@@ -38,42 +92,173 @@ class PersistentBase:
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        self._commit()
+
+    @classmethod
+    def bulk_create(cls, records):
+        """
+        Creates many records in the database with a single commit
+
+        The unit of work groups the rows of each table into batched INSERT
+        statements, related records are saved through their relationships.
+        """
+        logger.info("Creating %s %s records", len(records), cls.__name__)
+        with cls.unit_of_work():
+            for record in records:
+                record.id = None
+            db.session.add_all(records)
 
     def update(self):
         """
         Updates a Account to the database
+
+        The version column is incremented by the UPDATE, which only matches
+        the version that was read, so a concurrent change raises StaleDataError
         """
         logger.info("Updating %s", self.name)
-        db.session.commit()
+        self._commit()
 
     def delete(self):
         """Removes a Account from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
-        db.session.commit()
+        self._commit()
+
+    @classmethod
+    @contextmanager
+    def unit_of_work(cls):
+        """
+        Defers the commits of create, update and delete until the block ends
+
+        All the pending changes are flushed and committed once when the
+        outermost block exits, or rolled back if it raises. Ids are only
+        assigned after the block, so link new records through relationships.
+        """
+        info = db.session.info
+        depth = info.get("unit_of_work_depth", 0)
+        info["unit_of_work_depth"] = depth + 1
+        try:
+            yield db.session
+            if depth == 0:
+                db.session.commit()
+        except Exception:
+            if depth == 0:
+                db.session.rollback()
+            raise
+        finally:
+            info["unit_of_work_depth"] = depth
+
+    @staticmethod
+    def _commit():
+        """Commits the session unless a unit of work is in progress"""
+        if not db.session.info.get("unit_of_work_depth"):
+            db.session.commit()
 
     @classmethod
     def init_db(cls, app):
-        """Initializes the database session"""
+        """Initializes the database session, and the tables when DB_CREATE_ALL is set
+
+        No app context is pushed, the requests and the commands bring their own.
+        """
         logger.info("Initializing database")
         cls.app = app
+        strategy = app.config.get("EAGER_LOADING_STRATEGY")
+        if strategy:
+            PersistentBase.loading_strategy = strategy
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        if app.config.get("DB_CREATE_ALL", True):
+            db.create_all(app=app)  # make our sqlalchemy tables
+
+    @classmethod
+    def loader_options(cls, strategy=None):
+        """Returns the loader options for the eager relationships
+
+        Args:
+            strategy (string): one of LOADING_STRATEGIES, defaults to
+                the class loading_strategy
+        """
+        strategy = strategy or cls.loading_strategy
+        if strategy not in LOADING_STRATEGIES:
+            raise ValueError(f"Unknown loading strategy: {strategy}")
+        loader = LOADING_STRATEGIES[strategy]
+        return [loader(getattr(cls, name)) for name in cls.eager_relationships]
+
+    @classmethod
+    def _loading(cls, query, strategy=None, columns=None):
+        """Projects the query on the columns, or loads the eager relationships
+
+        With columns the query returns rows with only those attributes and
+        no relationship is loaded.
+        """
+        if columns:
+            return query.with_entities(*[getattr(cls, column) for column in columns])
+        return query.options(*cls.loader_options(strategy))
 
     @classmethod
-    def all(cls):
-        """Returns all of the records in the database"""
+    def all(cls, strategy=None, query=None, columns=None):
+        """Returns all of the records in the database, or all the records of a filtered query"""
         logger.info("Processing all records")
-        return cls.query.all()
+        if query is None:
+            query = cls.query
+        return cls._loading(query, strategy, columns).all()
+
+    @classmethod
+    def page(cls, after=None, limit=100, query=None, strategy=None, columns=None):
+        """Returns a page of records ordered by id using keyset pagination
+
+        Args:
+            after (int): id of the last record of the previous page
+            limit (int): maximum number of records in the page
+            query (Query): optional filtered query to paginate, defaults to
+                all the records of the class
+            columns (list): optional columns to select, they must include id
+
+        Returns:
+            a (records, next_after) tuple, next_after is None on the last page
+        """
+        logger.info("Processing page after %s (limit %s)", after, limit)
+        if query is None:
+            query = cls.query
+        if after is not None:
+            query = query.filter(cls.id > after)
+        # one extra row tells us if there is a next page without a COUNT
+        records = (
+            cls._loading(query, strategy, columns)
+            .order_by(cls.id)
+            .limit(limit + 1)
+            .all()
+        )
+        if len(records) > limit:
+            records = records[:limit]
+            return records, records[-1].id
+        return records, None
 
     @classmethod
-    def find(cls, by_id):
+    def row_statement(cls, query=None, after=None, limit=None):
+        """Returns the Core SELECT of all the table columns of a query, ordered by id
+
+        Args:
+            query (Query): optional filtered query, defaults to all the records
+            after (int): only the records with a greater id
+            limit (int): maximum number of rows
+        """
+        if query is None:
+            query = cls.query
+        if after is not None:
+            query = query.filter(cls.id > after)
+        query = query.with_entities(*cls.__table__.columns).order_by(cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.statement
+
+    @classmethod
+    def find(cls, by_id, strategy=None, columns=None):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        if columns:
+            return cls._loading(cls.query.filter(cls.id == by_id), columns=columns).first()
+        return cls.query.options(*cls.loader_options(strategy)).get(by_id)
 
 
 ######################################################################
@@ -85,21 +270,42 @@ class Employed(db.Model, PersistentBase):
     """
 
     app = None
+    eager_relationships = ("beneficiary",)
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(64))
-    job_position = db.Column(db.String(64))
+    name = db.Column(db.String(64), index=True)
+    job_position = db.Column(db.String(64), index=True)
     salary = db.Column(db.Numeric(precision=10, scale=2))
-    status =  db.Column(db.String(64))
-    date_hire = db.Column(db.Date(), nullable=False, default=date.today())
+    status =  db.Column(db.String(64), index=True)
+    date_hire = db.Column(db.Date(), nullable=False, default=date.today(), index=True)
     photo = db.Column(db.String(150))
+    # pending/ready/failed while the photo is uploaded in background
+    photo_status = db.Column(db.String(16))
+    # token of the upload job the pending photo waits for
+    photo_job = db.Column(db.String(32))
+    # incremented on every UPDATE, used for the ETags and optimistic locking
+    version = db.Column(db.Integer, nullable=False, default=1)
     # the one-to-may relation
-    beneficiary = db.relationship('Beneficiary',cascade="all,delete", backref='employed', lazy=True)
+    beneficiary = db.relationship('Beneficiary',cascade="all,delete", backref='employed', lazy=True,
+                                  order_by="Beneficiary.id")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<Employe {self.name} id=[{self.id}]>"
 
+    # fields of the serialized Employe, in order
+    FIELDS = ("id", "name", "job_position", "salary", "status", "date_hire", "photo", "photo_status")
+
+    @classmethod
+    def serialize_columns(cls, row, fields):
+        """Serializes the given fields of a row selected with columns"""
+        result = {field: getattr(row, field) for field in fields}
+        if result.get("date_hire") is not None:
+            result["date_hire"] = result["date_hire"].isoformat()
+        return result
+
     def serialize(self):
         """Serializes a Employe into a dictionary"""
         return {
@@ -110,8 +316,113 @@ class Employed(db.Model, PersistentBase):
             "status": self.status,
             "date_hire": self.date_hire.isoformat(),
             "photo": self.photo,
+            "photo_status": self.photo_status,
         }
 
+    def etag(self):
+        """Returns a strong ETag of the Employe document, beneficiaries included"""
+        return self.versions_etag(self, self.beneficiary)
+
+    @staticmethod
+    def versions_etag(employe, beneficiaries):
+        """Returns the ETag of an Employe document from the id and version of its rows"""
+        versions = [f"{employe.id}.{employe.version}"]
+        versions.extend(f"{b.id}.{b.version}" for b in beneficiaries)
+        return hashlib.sha1(":".join(versions).encode("utf-8")).hexdigest()
+
+    ##################################################
+    # Fast read path, no ORM instance is built
+    ##################################################
+
+    @classmethod
+    def read_documents(cls, query=None, after=None, limit=None, etags=False, connection=None):
+        """
+        Returns the serialized Employes of a query with their beneficiaries
+
+        Read only path for the listings: the rows are selected with Core and
+        turned into dictionaries by compiled serializers, skipping the
+        identity map and the attribute instrumentation of the ORM. The
+        documents are equal to serialize() with a "beneficiaries" list.
+
+        Args:
+            query (Query): optional filtered query, defaults to all the Employes
+            after (int): only the Employes with a greater id
+            limit (int): maximum number of Employes
+            etags (bool): also return the ETag of every document, in a
+                (documents, etags) tuple
+            connection (Connection): defaults to the connection of the session,
+                the async read API passes the one of its async engine
+        """
+        logger.info("Reading documents after %s (limit %s)", after, limit)
+        if connection is None:
+            connection = db.session.connection()
+        statement = cls.row_statement(query, after, limit)
+        rows = connection.execute(statement).fetchall()
+        if limit is None:
+            employed_ids = statement.with_only_columns(cls.__table__.c.id).order_by(None)
+        else:
+            employed_ids = [row.id for row in rows]
+        pairs = list(cls._with_beneficiaries(connection, rows, employed_ids))
+        documents = list(cls._documents(pairs))
+        if etags:
+            return documents, [cls.versions_etag(*pair) for pair in pairs]
+        return documents
+
+    @classmethod
+    def stream_documents(cls, batch_size=1000):
+        """Iterates over the serialized Employes of read_documents fetching them in batches
+
+        Rows are read through a server side cursor and the beneficiaries of
+        every batch with one more query.
+        """
+        logger.info("Streaming all documents in batches of %s", batch_size)
+        connection = db.session.connection()
+        result = connection.execution_options(stream_results=True).execute(cls.row_statement())
+        for rows in result.partitions(batch_size):
+            pairs = cls._with_beneficiaries(connection, rows, [row.id for row in rows])
+            yield from cls._documents(pairs)
+
+    @classmethod
+    def _with_beneficiaries(cls, connection, rows, employed_ids):
+        """Pairs every Employe row with its Beneficiary rows, read with a single query"""
+        table = Beneficiary.__table__
+        found = {}
+        statement = select(table).where(table.c.employed_id.in_(employed_ids)).order_by(table.c.id)
+        for beneficiary in connection.execute(statement):
+            found.setdefault(beneficiary.employed_id, []).append(beneficiary)
+        return ((row, found.get(row.id, [])) for row in rows)
+
+    @classmethod
+    def _documents(cls, pairs):
+        """Serializes the Employe rows paired with their Beneficiary rows"""
+        serialize = row_serializer(tuple(cls.__table__.columns), cls.FIELDS)
+        serialize_beneficiary = row_serializer(tuple(Beneficiary.__table__.columns), Beneficiary.FIELDS)
+        for row, beneficiaries in pairs:
+            document = serialize(row)
+            document["beneficiaries"] = [serialize_beneficiary(b) for b in beneficiaries]
+            yield document
+
+    @classmethod
+    def collection_etag(cls, connection=None):
+        """
+        Returns a strong ETag of all the Employes with two aggregate queries
+
+        New rows raise the max id, removed rows lower the count and updated
+        rows raise the sum of the versions.
+        """
+        if connection is None:
+            connection = db.session.connection()
+        state = []
+        for model in (cls, Beneficiary):
+            state.extend(
+                connection.execute(select(
+                    func.count(model.id),
+                    func.coalesce(func.max(model.id), 0),
+                    func.coalesce(func.sum(model.version), 0),
+                )).one()
+            )
+        return hashlib.sha1(repr(state).encode("utf-8")).hexdigest()
+
     def deserialize(self, data):
         """
         Deserializes a Employe from a dictionary
@@ -140,6 +451,29 @@ class Employed(db.Model, PersistentBase):
             ) from error
         return self
 
+    @classmethod
+    def save_photo(cls, employe_id, job, photo, photo_status):
+        """
+        Stores the result of a background photo upload
+
+        The UPDATE only matches the row while its photo still waits for the
+        given job, a photo changed meanwhile wins and the result is dropped.
+        The other columns may have changed, they are left as they are.
+
+        Returns:
+            True if the row was updated
+        """
+        logger.info("Saving the photo of Employe [%s]", employe_id)
+        table = cls.__table__
+        values = {"photo_status": photo_status, "photo_job": None, "version": table.c.version + 1}
+        if photo is not None:
+            values["photo"] = photo
+        result = db.session.execute(
+            table.update().where(table.c.id == employe_id, table.c.photo_job == job).values(**values)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
     @classmethod
     def find_by_name(cls, name):
         """Returns all Employes with the given name
@@ -150,6 +484,81 @@ class Employed(db.Model, PersistentBase):
         logger.info("Processing name query for %s ...", name)
         return cls.query.filter(cls.name == name)
 
+    @classmethod
+    def search(cls, text, limit=20, beneficiaries=False):
+        """Returns up to limit (Employe, score) tuples ranked by name similarity
+
+        Args:
+            text (string): partial or misspelled name to look for
+            beneficiaries (bool): also match the names of the beneficiaries
+        """
+        logger.info("Processing search for %s ...", text)
+        targets = [(cls.id, cls.name)]
+        if beneficiaries:
+            targets.append((Beneficiary.employed_id, Beneficiary.name))
+        if db.session().get_bind().dialect.name == "postgresql":
+            scores = _trigram_scores(targets, text, limit)
+        else:
+            scores = _python_scores(targets, text)
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        found = {
+            employe.id: employe
+            for employe in cls.query.options(*cls.loader_options())
+            .filter(cls.id.in_([employe_id for employe_id, _ in best]))
+        }
+        return [(found[employe_id], score) for employe_id, score in best if employe_id in found]
+
+    @classmethod
+    def find_by_filters(cls, name=None, job_position=None, status=None,
+                        hired_from=None, hired_to=None, query=None):
+        """Returns a query of the Employes matching all the given filters
+
+        Args:
+            name, job_position, status (string): exact values to match
+            hired_from, hired_to (date): inclusive range of date_hire
+            query (Query): query to filter, defaults to the one of the session
+        """
+        logger.info("Processing filtered query ...")
+        if query is None:
+            query = cls.query
+        if name is not None:
+            query = query.filter(cls.name == name)
+        if job_position is not None:
+            query = query.filter(cls.job_position == job_position)
+        if status is not None:
+            query = query.filter(cls.status == status)
+        if hired_from is not None:
+            query = query.filter(cls.date_hire >= hired_from)
+        if hired_to is not None:
+            query = query.filter(cls.date_hire <= hired_to)
+        return query
+
+
+def _trigram_scores(targets, text, limit):
+    """Ranks the names with the pg_trgm indexes, returns {employe_id: score}"""
+    scores = {}
+    for employe_id, name in targets:
+        rank = func.greatest(func.similarity(name, text), func.word_similarity(text, name))
+        rows = (
+            db.session.query(employe_id, rank)
+            .filter(or_(name.op("%")(text), name.op("%>")(text)))
+            .order_by(rank.desc())
+            .limit(limit)
+        )
+        for row_id, score in rows:
+            scores[row_id] = max(score, scores.get(row_id, 0.0))
+    return scores
+
+
+def _python_scores(targets, text):
+    """Ranks the names in Python for databases without pg_trgm, returns {employe_id: score}"""
+    scores = {}
+    for employe_id, name in targets:
+        for row_id, row_name in db.session.query(employe_id, name).yield_per(1000):
+            score = search.score(text, row_name)
+            if score > scores.get(row_id, 0.0):
+                scores[row_id] = score
+    return scores
 
 
 ######################################################################
@@ -168,11 +577,18 @@ class Beneficiary(db.Model, PersistentBase):
     relationship = db.Column(db.String(64))
     gender = db.Column(db.String(64))
     date_born = db.Column(db.Date(), nullable=False, default=date.today())
-    employed_id = db.Column(db.Integer,  db.ForeignKey('employed.id'),nullable=False)
+    employed_id = db.Column(db.Integer,  db.ForeignKey('employed.id'),nullable=False, index=True)
+    # incremented on every UPDATE, used for the ETags and optimistic locking
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<Beneficiary {self.name} id=[{self.id}]>"
 
+    # fields of the serialized Beneficiary, in order
+    FIELDS = ("id", "name", "relationship", "gender", "date_born", "employed_id")
+
     def serialize(self):
         """Serializes a Beneficiary into a dictionary"""
         return {
@@ -211,8 +627,37 @@ class Beneficiary(db.Model, PersistentBase):
             ) from error
         return self
 
+    @classmethod
+    def find_by_employes(cls, employed_ids):
+        """Returns the beneficiaries of many Employes grouped by employed_id"""
+        logger.info("Processing lookup for %s employes ...", len(employed_ids))
+        found = {}
+        if not employed_ids:
+            return found
+        query = cls.query.filter(cls.employed_id.in_(employed_ids)).order_by(cls.id)
+        for beneficiary in query:
+            found.setdefault(beneficiary.employed_id, []).append(beneficiary)
+        return found
+
     @classmethod
     def find_by_employe(cls, employed_id):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...")
-        return cls.query.filter(cls.employed_id == employed_id).all()
\ No newline at end of file
+        return cls.query.filter(cls.employed_id == employed_id).all()
+
+
+# Trigram indexes for Employed.search, only PostgreSQL has pg_trgm
+event.listen(
+    Employed.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+for _table in (Employed.__table__, Beneficiary.__table__):
+    event.listen(
+        _table,
+        "after_create",
+        DDL(
+            "CREATE INDEX IF NOT EXISTS ix_%(table)s_name_trgm "
+            "ON %(table)s USING gin (name gin_trgm_ops)"
+        ).execute_if(dialect="postgresql"),
+    )
@@ -4,21 +4,38 @@ Employe Service
 This microservice handles the lifecycle of Employes
 """
 # pylint: disable=unused-import
+import hashlib
+from datetime import date
 from flask import jsonify, request, make_response, abort, url_for   # noqa; F401
-from service.models import Employed, Beneficiary
-from service.common import status, util  # HTTP Status Codes
-from . import app  # Import Flask application
+from flask import Blueprint, Response, current_app, json, stream_with_context
+from service.models import db, Employed, Beneficiary
+from service.common import status, util, uploads, validation, cache, metrics, replicas, compression
+
+# The routes are registered on the app by create_app()
+api = Blueprint("api", __name__)
+
 
 ############################################################
 # Health Endpoint
 ############################################################
-@app.route("/health")
+@api.route("/health")
 def health():
     """Health Status"""
-    return jsonify(dict(status="OK")), status.HTTP_200_OK
+    result = dict(status="OK")
+    upload_queue = uploads.get_upload_queue()
+    if upload_queue is not None:
+        result["uploads"] = upload_queue.metrics()
+    result["cache"] = cache.get_cache().stats()
+    return jsonify(result), status.HTTP_200_OK
+
 
+@api.route("/metrics")
+def prometheus_metrics():
+    """Metrics of all the workers in the Prometheus text format"""
+    return Response(metrics.render(), status=status.HTTP_200_OK, content_type=metrics.CONTENT_TYPE)
 
-@app.route("/error")
+
+@api.route("/error")
 def error():
     """Error Status"""
     abort(status.HTTP_500_INTERNAL_SERVER_ERROR, "Server Error")
@@ -27,7 +44,7 @@ def error():
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@api.route("/")
 def index():
     """Root URL response"""
     return (
@@ -42,119 +59,368 @@ def index():
 ######################################################################
 # CREATE A NEW EMPLOYED
 ######################################################################
-@app.route("/employe", methods=["POST"])
+@api.route("/employe", methods=["POST"])
 def create_employes():
     """
     Creates an Employe
     This endpoint will create an Employe based the data in the body that is posted
     """
-    app.logger.info("Request to create an Employe")
+    current_app.logger.info("Request to create an Employe")
     check_content_type("application/json")
-    try:
-        employe_data = request.get_json()["employe"]
-        beneficiary_data = request.get_json()["beneficiary"]
-    except KeyError:
-        abort(status.HTTP_400_BAD_REQUEST)
-    img = employe_data["photo"]
-    url= util.upload_img(img,employe_data["name"])
-    employe_data["photo"] = url
-    employe = Employed()
-    employe.deserialize(employe_data)
-    employe.create()
-    message = employe.serialize()
-    message["beneficiaries"] = []
-    if beneficiary_data is not None:
-        for b in beneficiary_data:
-            beneficiary = Beneficiary()
-            beneficiary.deserialize(b)
-            beneficiary.employed_id = employe.id
-            beneficiary.create()
-            message["beneficiaries"].append(beneficiary.serialize())
+    document = request.get_json()
+    validation.validate_document(document)
+    employe_data = document["employe"]
+    beneficiary_data = document.get("beneficiary")
+    photo_key = employe_data.pop("photo_key", None)
+    img = employe_data.get("photo")
+    upload_queue = None
+    if photo_key is not None:
+        employe_data["photo"] = verify_photo_key(photo_key)
+    elif validation.is_data_uri(img):
+        upload_queue = uploads.get_upload_queue()
+        if upload_queue is None:
+            employe_data["photo"] = util.upload_img(img, employe_data["name"])
+        else:
+            employe_data["photo"] = None
+    with Employed.unit_of_work():
+        employe = Employed()
+        employe.deserialize(employe_data)
+        if upload_queue is not None:
+            uploads.mark_pending(employe)
+        employe.create()
+        if beneficiary_data is not None:
+            for b in beneficiary_data:
+                beneficiary = Beneficiary()
+                # employed_id is set from the relationship on flush
+                beneficiary.deserialize(dict(b, employed_id=None))
+                employe.beneficiary.append(beneficiary)
+                beneficiary.create()
+    if upload_queue is not None:
+        upload_photo_later(upload_queue, employe, img)
+    message = serialize_employe(employe)
      #Uncomment once get_accounts has been implemented
-    location_url = url_for("list_accounts", employe_id=employe.id, _external=True)
+    location_url = url_for(".list_accounts", employe_id=employe.id, _external=True)
     return make_response(
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
 
+
+######################################################################
+# REQUEST A PHOTO UPLOAD
+######################################################################
+@api.route("/photos", methods=["POST"])
+def create_photo_upload():
+    """
+    Creates a Photo upload
+    This endpoint returns a presigned POST the client uses to upload the
+    photo straight into the storage, a multipart form with the given fields
+    and the image as its last "file" field, and the key to send later as
+    photo_key when creating or updating the Employe. The storage refuses a
+    photo larger than PHOTO_MAX_SIZE bytes.
+    """
+    current_app.logger.info("Request to create a photo upload")
+    check_content_type("application/json")
+    data = request.get_json()
+    content_type = data.get("content_type") if isinstance(data, dict) else None
+    expires_in = current_app.config["PHOTO_PRESIGN_EXPIRES"]
+    max_size = current_app.config["PHOTO_MAX_SIZE"]
+    try:
+        key, url, fields = util.presign_upload(content_type, max_size=max_size, expires_in=expires_in)
+    except ValueError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
+    message = {
+        "key": key,
+        "url": url,
+        "method": "POST",
+        "fields": fields,
+        "max_size": max_size,
+        "expires_in": expires_in,
+    }
+    return jsonify(message), status.HTTP_201_CREATED
+
+
+######################################################################
+# CREATE EMPLOYES IN BATCH
+######################################################################
+@api.route("/employe/batch", methods=["POST"])
+def create_employes_batch():
+    """
+    Creates many Employes
+    This endpoint takes a list of {employe, beneficiary} documents, validates
+    all of them and creates them in a single transaction. Nothing is created
+    if any of the documents is invalid.
+    """
+    current_app.logger.info("Request to create Employes in batch")
+    check_content_type("application/json")
+    documents = request.get_json()
+    if not isinstance(documents, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Body must be a list of employes")
+    max_size = current_app.config["MAX_BATCH_SIZE"]
+    if len(documents) > max_size:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"Batch of {len(documents)} employes exceeds the maximum of {max_size}",
+        )
+
+    errors = []
+    for index, document in enumerate(documents):
+        document_errors = validation.document_errors(document)
+        if document_errors:
+            errors.append({"index": index, "errors": document_errors})
+    if errors:
+        current_app.logger.warning("Rejected batch with %s invalid employes", len(errors))
+        return (
+            jsonify(
+                status=status.HTTP_400_BAD_REQUEST,
+                error="Bad Request",
+                message=f"{len(errors)} of {len(documents)} employes are invalid",
+                errors=errors,
+            ),
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    employes = [deserialize_document(document) for document in documents]
+    for document, employe in zip(documents, employes):
+        photo_key = document["employe"].get("photo_key")
+        if photo_key is not None:
+            employe.photo = verify_photo_key(photo_key)
+        elif validation.is_data_uri(employe.photo):
+            employe.photo = util.upload_img(employe.photo, employe.name)
+    with Employed.unit_of_work() as session:
+        Employed.bulk_create(employes)
+        # serialized once the ids are assigned, before the commit expires them
+        session.flush()
+        results = [serialize_employe(employe) for employe in employes]
+    return jsonify(results), status.HTTP_201_CREATED
+
 ######################################################################
 # LIST ALL ACCOUNTS
 ######################################################################
 
 
-@app.route("/employe", methods=["GET"])
+@api.route("/employe", methods=["GET"])
 def list_accounts():
     """
     Read all Emplopyes.
-    This endpoint will read all Accounts on the database.
+    This endpoint will read all Accounts on the database, optionally
+    filtered by name, job_position, status and a hired_from/hired_to range.
+    ?fields= and ?include=beneficiaries return only the requested data.
     """
-    app.logger.info("Request to list an Employe")
-    employes = Employed.all()
+    current_app.logger.info("Request to list an Employe")
+    query = Employed.find_by_filters(**get_filter_args())
+    sparse = get_sparse_args()
+    if sparse is not None:
+        return list_sparse_accounts(query, *sparse)
+    if "limit" not in request.args and "cursor" not in request.args:
+        etag = Employed.collection_etag()
+        match = none_match(etag)
+        if match is not None:
+            return not_modified(match)
+        return list_response(Employed.read_documents(query=query), etag)
+
+    after, limit = get_page_args()
+    # one extra document tells if there is a next page without a COUNT
+    employes, etags = Employed.read_documents(query=query, after=after, limit=limit + 1, etags=True)
+    return page_response(employes, etags, after, limit)
+
+
+def list_response(employes, etag):
+    """Returns all the Employe documents with the ETag of the collection"""
     if not employes:
         abort(status.HTTP_404_NOT_FOUND, "Not Found Employes")
-    employes = [a.serialize() for a in employes]
-    for a in employes:
-        beneficiaries = Beneficiary.find_by_employe(a["id"])
-        b = [b.serialize() for b in beneficiaries]
-        a["beneficiaries"] = b
-    return jsonify(employes), status.HTTP_200_OK
+    response = make_response(jsonify(employes), status.HTTP_200_OK)
+    response.set_etag(etag)
+    return response
+
+
+def page_response(employes, etags, after, limit):
+    """Returns a page of Employe documents, read with one extra to link the next page"""
+    if not employes and after is None:
+        abort(status.HTTP_404_NOT_FOUND, "Not Found Employes")
+    headers = {}
+    if len(employes) > limit:
+        employes, etags = employes[:limit], etags[:limit]
+        headers = next_page_headers(employes[-1]["id"], limit, request.args)
+    etag = combine_etags(etags)
+    match = none_match(etag)
+    if match is not None:
+        return not_modified(match, headers)
+    response = make_response(jsonify(employes), status.HTTP_200_OK, headers)
+    response.set_etag(etag)
+    return response
+
+
+def list_sparse_accounts(query, fields, include_beneficiaries):
+    """Lists only the requested fields, selecting just their columns"""
+    if "limit" not in request.args and "cursor" not in request.args:
+        rows = Employed.all(query=query, columns=fields)
+        if not rows:
+            abort(status.HTTP_404_NOT_FOUND, "Not Found Employes")
+        return sparse_response(serialize_sparse(rows, fields, include_beneficiaries))
+
+    after, limit = get_page_args()
+    rows, next_after = Employed.page(after=after, limit=limit, query=query, columns=fields)
+    if not rows and after is None:
+        abort(status.HTTP_404_NOT_FOUND, "Not Found Employes")
+    headers = {}
+    if next_after is not None:
+        headers = next_page_headers(next_after, limit, request.args)
+    return sparse_response(serialize_sparse(rows, fields, include_beneficiaries), headers)
+
+
+######################################################################
+# SEARCH EMPLOYES
+######################################################################
+
+
+@api.route("/employe/search", methods=["GET"])
+def search_accounts():
+    """
+    Search Employes.
+    This endpoint ranks the Employes whose name looks like ?q=, a partial or
+    misspelled name. With ?beneficiaries=true the names of their
+    beneficiaries are matched too.
+    """
+    current_app.logger.info("Request to search Employes")
+    text = request.args.get("q", "").strip()
+    if len(text) < 2:
+        abort(status.HTTP_400_BAD_REQUEST, "q must have at least 2 characters")
+    limit = get_limit(current_app.config["SEARCH_LIMIT"], current_app.config["MAX_SEARCH_LIMIT"])
+    beneficiaries = request.args.get("beneficiaries", "false").lower() == "true"
+    results = []
+    for employe, score in Employed.search(text, limit=limit, beneficiaries=beneficiaries):
+        result = serialize_employe(employe)
+        result["score"] = round(score, 4)
+        results.append(result)
+    return jsonify(results), status.HTTP_200_OK
+
+######################################################################
+# EXPORT ALL EMPLOYES
+######################################################################
+
+
+@api.route("/employe/export", methods=["GET"])
+def export_accounts():
+    """
+    Export all Employes.
+    This endpoint streams every Employe with its beneficiaries as
+    newline-delimited JSON, one document per line.
+    """
+    current_app.logger.info("Request to export all Employes")
+    batch_size = current_app.config["EXPORT_BATCH_SIZE"]
+
+    def generate():
+        for employe in Employed.stream_documents(batch_size=batch_size):
+            yield json.dumps(employe) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        status=status.HTTP_200_OK,
+        mimetype="application/x-ndjson",
+    )
 
 ######################################################################
 # READ AN ACCOUNT
 ######################################################################
 
 
-@app.route("/employe/<int:employe_id>", methods=["GET"])
+@api.route("/employe/<int:employe_id>", methods=["GET"])
 def read_an_account(employe_id):
     """
     Read an Employe.
     This endpoint will read an Account based on the id given in the url.
     """
-    app.logger.info("Request to read an Account")
-    employe = Employed.find(employe_id)
-    if not employe:
-        abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe_id}] not found")
-    result = employe.serialize()
-    beneficiaries = Beneficiary.find_by_employe(employe_id)
-    b = [b.serialize() for b in beneficiaries]
-    result["beneficiaries"] = b
-    return result, status.HTTP_200_OK
+    current_app.logger.info("Request to read an Account")
+    employe_cache = cache.get_cache()
+    entry = employe_cache.get(employe_id)
+    sparse = get_sparse_args()
+    if sparse is not None:
+        fields, include_beneficiaries = sparse
+        if entry is not None:
+            document = {field: entry["document"][field] for field in fields}
+            if include_beneficiaries:
+                document["beneficiaries"] = entry["document"]["beneficiaries"]
+            return sparse_response(document)
+        row = Employed.find(employe_id, columns=fields)
+        if not row:
+            abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe_id}] not found")
+        return sparse_response(serialize_sparse([row], fields, include_beneficiaries)[0])
+    if entry is None:
+        generation = employe_cache.generation()
+        employe = Employed.find(employe_id)
+        if not employe:
+            abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe_id}] not found")
+        etag = employe.etag()
+        match = none_match(etag)
+        if match is not None:
+            return not_modified(match)
+        entry = {"etag": etag, "document": serialize_employe(employe)}
+        # a replica may lag, the cache only keeps the documents of the primary
+        if not replicas.uses_replica(db.session):
+            employe_cache.set(employe_id, entry, generation)
+    else:
+        match = none_match(entry["etag"])
+        if match is not None:
+            return not_modified(match)
+    response = make_response(jsonify(entry["document"]), status.HTTP_200_OK)
+    response.set_etag(entry["etag"])
+    return response
 
 
 ######################################################################
 # UPDATE AN EXISTING EMPLOYE
 ######################################################################
 
-@app.route("/employe/<int:employe_id>", methods=["PUT"])
+@api.route("/employe/<int:employe_id>", methods=["PUT"])
 def update_account(employe_id):
     """
     Update an Employe.
     This endpoint will update an exit Account based on the data given in the body.
     """
-    app.logger.info("Request to update an Account")
-    employe = Employed.find(employe_id)
+    current_app.logger.info("Request to update an Account")
     data_employe = request.get_json()
-    img = data_employe["photo"]
-    if "image" in img:
-        url= util.upload_img(img,data_employe["name"])
-        data_employe["photo"] = url
+    validation.EMPLOYE.validate(data_employe)
+    employe = Employed.find(employe_id)
     if not employe:
         abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe_id}] not found")
+    if request.if_match and compression.matching_etag(request.if_match, employe.etag(), weak=False) is None:
+        abort(status.HTTP_412_PRECONDITION_FAILED, f"Employe [{employe_id}] was modified")
+    photo_key = data_employe.pop("photo_key", None)
+    img = data_employe.get("photo")
+    upload_queue = None
+    if photo_key is not None:
+        data_employe["photo"] = verify_photo_key(photo_key)
+    elif validation.is_data_uri(img):
+        upload_queue = uploads.get_upload_queue()
+        if upload_queue is None:
+            data_employe["photo"] = util.upload_img(img, data_employe["name"])
+        else:
+            # keep the current photo until the new one is uploaded
+            data_employe["photo"] = employe.photo
     employe.deserialize(data_employe)
+    if upload_queue is not None:
+        uploads.mark_pending(employe)
+    elif photo_key is not None or validation.is_data_uri(img):
+        uploads.mark_ready(employe)
     employe.update()
-    return employe.serialize(), status.HTTP_200_OK
+    if upload_queue is not None:
+        upload_photo_later(upload_queue, employe, img)
+    response = make_response(jsonify(employe.serialize()), status.HTTP_200_OK)
+    response.set_etag(employe.etag())
+    return response
 
 
 ######################################################################
 # DELETE AN EMPLOYE
 ######################################################################
 
-@app.route("/employe/<int:employe_id>", methods=["DELETE"])
+@api.route("/employe/<int:employe_id>", methods=["DELETE"])
 def delete_account(employe_id):
     """
     Delete an employe.
     This endpoint will delete an exit employe based on its id.
     """
-    app.logger.info("Request to delete an employe")
+    current_app.logger.info("Request to delete an employe")
     employe = Employed.find(employe_id)
     if not employe:
         abort(status.HTTP_404_NOT_FOUND, f"Employe [{employe}] not found")
@@ -168,12 +434,158 @@ def delete_account(employe_id):
 ######################################################################
 
 
+def serialize_employe(employe):
+    """Serializes an Employe with its already loaded beneficiaries"""
+    result = employe.serialize()
+    result["beneficiaries"] = [b.serialize() for b in employe.beneficiary]
+    return result
+
+
+def verify_photo_key(photo_key):
+    """
+    Checks that a photo uploaded with a presigned POST exists and returns its url
+
+    Only the keys issued by create_photo_upload are accepted, not any other
+    object of the bucket.
+    """
+    if not util.is_upload_key(photo_key):
+        abort(status.HTTP_400_BAD_REQUEST, f"Photo [{photo_key}] is not a photo upload key")
+    if not util.object_exists(photo_key):
+        abort(status.HTTP_400_BAD_REQUEST, f"Photo [{photo_key}] was not uploaded")
+    return util.photo_url(photo_key)
+
+
+def upload_photo_later(upload_queue, employe, img):
+    """Enqueues the photo upload of a saved Employe, uploads it inline if the queue is full"""
+    if upload_queue.submit(employe.id, img, employe.name, employe.photo_job):
+        return
+    employe.photo = util.upload_img(img, employe.name)
+    uploads.mark_ready(employe)
+    employe.update()
+
+
+def deserialize_document(document):
+    """Builds an Employe and its beneficiaries from a validated {employe, beneficiary} document"""
+    employe = Employed().deserialize(document["employe"])
+    for data in document.get("beneficiary") or []:
+        # the employe id is only known once the batch is inserted
+        beneficiary = Beneficiary().deserialize(dict(data, employed_id=None))
+        employe.beneficiary.append(beneficiary)
+    return employe
+
+
+def get_sparse_args():
+    """Returns the (fields, include_beneficiaries) of a sparse read, None for a full one"""
+    if "fields" not in request.args and "include" not in request.args:
+        return None
+    fields = list(Employed.FIELDS)
+    if "fields" in request.args:
+        fields = [f.strip() for f in request.args["fields"].split(",") if f.strip()]
+        unknown = sorted(set(fields) - set(Employed.FIELDS))
+        if unknown:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Unknown fields {', '.join(unknown)}, use {', '.join(Employed.FIELDS)}",
+            )
+        if "id" not in fields:
+            fields.insert(0, "id")  # the id is always returned
+    include = [i.strip() for i in request.args.get("include", "").split(",") if i.strip()]
+    if set(include) - {"beneficiaries"}:
+        abort(status.HTTP_400_BAD_REQUEST, "Only beneficiaries can be included")
+    return tuple(fields), "beneficiaries" in include
+
+
+def serialize_sparse(rows, fields, include_beneficiaries):
+    """Serializes the selected fields of the rows, adding their beneficiaries in one query"""
+    documents = [Employed.serialize_columns(row, fields) for row in rows]
+    if include_beneficiaries:
+        found = Beneficiary.find_by_employes([document["id"] for document in documents])
+        for document in documents:
+            document["beneficiaries"] = [b.serialize() for b in found.get(document["id"], [])]
+    return documents
+
+
+def sparse_response(documents, headers=None):
+    """Returns the documents with an ETag of their content, or a 304"""
+    response = make_response(jsonify(documents), status.HTTP_200_OK, headers or {})
+    response.add_etag()
+    etag, _ = response.get_etag()
+    match = none_match(etag)
+    if match is not None:
+        return not_modified(match, headers)
+    return response
+
+
+def combine_etags(etags):
+    """Returns a strong ETag for a list of documents"""
+    return hashlib.sha1(":".join(etags).encode("utf-8")).hexdigest()
+
+
+def none_match(etag):
+    """Returns the tag of If-None-Match matching the etag in any encoding, or None"""
+    return compression.matching_etag(request.if_none_match, etag)
+
+
+def not_modified(etag, headers=None):
+    """Returns a 304 response for a client that already has the etag, as sent in If-None-Match"""
+    response = make_response("", status.HTTP_304_NOT_MODIFIED, headers or {})
+    response.set_etag(etag)
+    return response
+
+
+def get_filter_args():
+    """Returns the Employe filters of the request"""
+    filters = {
+        name: request.args.get(name) for name in ("name", "job_position", "status")
+    }
+    for name in ("hired_from", "hired_to"):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        try:
+            filters[name] = date.fromisoformat(value)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"{name} must be a date in YYYY-MM-DD format")
+    return filters
+
+
+def get_limit(default, maximum):
+    """Returns the ?limit= argument of the request, capped to maximum"""
+    try:
+        limit = int(request.args.get("limit", default))
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be an integer")
+    if limit < 1:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be greater than 0")
+    return min(limit, maximum)
+
+
+def get_page_args():
+    """Returns the (after, limit) keyset pagination arguments of the request"""
+    limit = get_limit(current_app.config["PAGE_SIZE"], current_app.config["MAX_PAGE_SIZE"])
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            after = util.decode_cursor(cursor)
+        except ValueError as error:
+            abort(status.HTTP_400_BAD_REQUEST, str(error))
+    return after, limit
+
+
+def next_page_headers(last_id, limit, args):
+    """Returns the Link and X-Next-Cursor headers of the page after the Employe last_id"""
+    cursor = util.encode_cursor(last_id)
+    next_url = url_for(".list_accounts", _external=True, **dict(args, limit=limit, cursor=cursor))
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": cursor}
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
     if content_type and content_type == media_type:
         return
-    app.logger.error("Invalid Content-Type: %s", content_type)
+    current_app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         f"Content-Type must be {media_type}",
@@ -0,0 +1,138 @@
+"""
+Test cases for the app factory and the gunicorn hooks
+"""
+import os
+import runpy
+import greenlet
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service import app, create_app, init_worker
+from service.common import cache, replicas, storage
+from service.models import db
+
+GUNICORN_CONFIG = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+
+
+######################################################################
+#  A P P   F A C T O R Y   T E S T   C A S E S
+######################################################################
+class TestCreateApp(TestCase):
+    """Test Cases for create_app and init_worker"""
+
+    def setUp(self):
+        # create_app initializes the module level storage and cache
+        for module, name in ((storage, "STORAGE"), (cache, "CACHE"), (replicas, "ROUTER")):
+            patcher = patch.object(module, name, getattr(module, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_create_app(self):
+        """It should create an app with all the routes and no pushed context"""
+        new_app = create_app()
+        self.assertIsNot(new_app, app)
+        rules = {rule.rule for rule in new_app.url_map.iter_rules()}
+        self.assertTrue({"/health", "/metrics", "/employe", "/employe/<int:employe_id>"} <= rules)
+        self.assertIn("db-create", new_app.cli.list_commands(None))
+        resp = new_app.test_client().get("/health")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_skip_create_all(self):
+        """It should not create the tables unless DB_CREATE_ALL is set"""
+        with patch("service.config.DB_CREATE_ALL", False), patch.object(db, "create_all") as create_all:
+            create_app()
+        create_all.assert_not_called()
+
+    def test_replicas(self):
+        """It should create an engine for every replica of the config"""
+        uris = "sqlite:////tmp/replica-1.db, sqlite:////tmp/replica-2.db"
+        with patch("service.config.DATABASE_REPLICA_URIS", uris):
+            create_app()
+        self.assertEqual(
+            [engine.url.database for engine in replicas.ROUTER.engines],
+            ["/tmp/replica-1.db", "/tmp/replica-2.db"],
+        )
+        with patch.object(replicas.ROUTER, "dispose") as dispose:
+            init_worker(app)
+        dispose.assert_called_once_with(close=False)
+
+    def test_init_worker(self):
+        """It should drop the inherited connections and warm the worker"""
+        engine = db.get_engine(app)
+        with patch.object(engine, "dispose") as dispose, \
+                patch.object(storage.get_storage(), "warm") as warm:
+            init_worker(app)
+        dispose.assert_called_once_with(close=False)
+        warm.assert_called_once()
+
+    def test_session_per_greenlet(self):
+        """It should give every greenlet its own database session, like gevent"""
+        sessions = []
+
+        def request():
+            with app.app_context():
+                session = db.session()
+                main.switch()  # let the other request run
+                self.assertIs(db.session(), session)
+                sessions.append(session)
+                db.session.remove()
+
+        main = greenlet.getcurrent()
+        requests = [greenlet.greenlet(request) for _ in range(2)]
+        for started in requests:
+            started.switch()
+        for started in requests:
+            started.switch()
+        self.assertEqual(len(sessions), 2)
+        self.assertIsNot(sessions[0], sessions[1])
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(TestCase):
+    """Test Cases for the gunicorn configuration"""
+
+    def setUp(self):
+        with patch.dict(os.environ, {"GUNICORN_WORKERS": "3", "GUNICORN_THREADS": "8"}):
+            self.config = runpy.run_path(GUNICORN_CONFIG)
+            self.create_all = os.environ["DB_CREATE_ALL"]
+            self.pool_size = os.environ["DB_POOL_SIZE"]
+            self.cache_backend = os.environ.get("CACHE_BACKEND")
+
+    def test_settings(self):
+        """It should preload the app and skip the tables in the workers"""
+        self.assertEqual(self.config["workers"], 3)
+        self.assertTrue(self.config["preload_app"])
+        self.assertEqual(self.create_all, "false")
+        # the workers do not share the memory cache
+        self.assertEqual(self.cache_backend, "null")
+
+    def test_concurrency(self):
+        """It should serve the requests with threads, one connection each"""
+        self.assertEqual(self.config["worker_class"], "gthread")
+        self.assertEqual(self.config["threads"], 8)
+        self.assertEqual(self.pool_size, "8")
+
+    def test_hooks(self):
+        """It should create the tables in the master and init every worker"""
+        with patch.object(db, "create_all") as create_all, \
+                patch("service.common.metrics.clean_directory") as clean_directory:
+            self.config["on_starting"](MagicMock())
+        create_all.assert_called_once_with(app=app)
+        clean_directory.assert_called_once_with()
+        with patch("service.common.metrics.worker_exited") as worker_exited:
+            self.config["child_exit"](MagicMock(), MagicMock(pid=1234))
+        worker_exited.assert_called_once_with(1234)
+        with patch("service.init_worker") as init:
+            self.config["post_worker_init"](MagicMock())
+        init.assert_called_once_with(app)
+
+    def test_gevent_without_psycogreen(self):
+        """It should warn when the gevent workers cannot patch psycopg2"""
+        worker = MagicMock()
+        with patch.dict(self.config["post_worker_init"].__globals__, {"worker_class": "gevent"}), \
+                patch.dict("sys.modules", {"psycogreen": None, "psycogreen.gevent": None}), \
+                patch("service.init_worker") as init:
+            self.config["post_worker_init"](worker)
+        worker.log.warning.assert_called_once()
+        init.assert_called_once_with(app)
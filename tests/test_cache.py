@@ -0,0 +1,79 @@
+"""
+Test cases for the Employe document cache
+
+"""
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import cache
+from service.common.cache import MemoryCache, NullCache, EmployeCache
+
+
+def make_cache(config):
+    """Factory used to test the pluggable backends"""
+    return MemoryCache(config["CACHE_MAX_SIZE"], ttl=1)
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCache(TestCase):
+    """Test Cases for the cache backends"""
+
+    def test_memory_cache_lru(self):
+        """It should evict the least recently used entry"""
+        memory = MemoryCache(max_size=2, ttl=60)
+        memory.set("a", 1)
+        memory.set("b", 2)
+        self.assertEqual(memory.get("a"), 1)
+        memory.set("c", 3)
+        self.assertIsNone(memory.get("b"))
+        self.assertEqual(memory.get("a"), 1)
+        self.assertEqual(memory.get("c"), 3)
+
+    def test_memory_cache_ttl(self):
+        """It should expire the entries after the TTL"""
+        memory = MemoryCache(max_size=2, ttl=10)
+        with patch("time.monotonic", return_value=100):
+            memory.set("a", 1)
+        with patch("time.monotonic", return_value=105):
+            self.assertEqual(memory.get("a"), 1)
+        with patch("time.monotonic", return_value=111):
+            self.assertIsNone(memory.get("a"))
+
+    def test_employe_cache_counters(self):
+        """It should count the hits, misses and invalidations"""
+        employe_cache = EmployeCache(MemoryCache())
+        self.assertIsNone(employe_cache.get(1))
+        employe_cache.set(1, {"id": 1})
+        self.assertEqual(employe_cache.get(1), {"id": 1})
+        employe_cache.invalidate([1])
+        self.assertIsNone(employe_cache.get(1))
+        self.assertEqual(employe_cache.stats(), {"hits": 1, "misses": 2, "invalidations": 1, "stale": 0})
+
+    def test_employe_cache_stale(self):
+        """It should not store a document read before an invalidation"""
+        employe_cache = EmployeCache(MemoryCache())
+        generation = employe_cache.generation()
+        employe_cache.invalidate([2])
+        employe_cache.set(1, {"id": 1}, generation)
+        self.assertIsNone(employe_cache.get(1))
+        employe_cache.set(1, {"id": 1}, employe_cache.generation())
+        self.assertEqual(employe_cache.get(1), {"id": 1})
+        self.assertEqual(employe_cache.stats()["stale"], 1)
+
+    def test_null_cache(self):
+        """It should never cache anything"""
+        employe_cache = EmployeCache(NullCache())
+        employe_cache.set(1, {"id": 1})
+        self.assertIsNone(employe_cache.get(1))
+
+    def test_create_backend(self):
+        """It should build the backend selected in the config"""
+        config = {"CACHE_MAX_SIZE": 3, "CACHE_TTL": 5}
+        config["CACHE_BACKEND"] = "memory"
+        self.assertIsInstance(cache.create_backend(config), MemoryCache)
+        config["CACHE_BACKEND"] = "null"
+        self.assertIsInstance(cache.create_backend(config), NullCache)
+        config["CACHE_BACKEND"] = "tests.test_cache:make_cache"
+        backend = cache.create_backend(config)
+        self.assertEqual((backend.max_size, backend.ttl), (3, 1))
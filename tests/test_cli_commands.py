@@ -5,7 +5,9 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service import app
+from service.models import Employed
+from service.common.cli_commands import db_create, bench_reads, bench_async
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +23,21 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    def test_bench_reads(self):
+        """It should time both read paths and delete the benchmark rows"""
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}):
+            result = self.runner.invoke(bench_reads, ["--rows", "5", "--repeat", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("5 rows: orm", result.output)
+        with app.app_context():
+            self.assertEqual(Employed.query.filter(Employed.name.like("Employe %")).count(), 0)
+
+    def test_bench_async(self):
+        """It should measure both read paths and delete the benchmark rows"""
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}):
+            result = self.runner.invoke(bench_async, ["--rows", "5", "--requests", "10", "--concurrency", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("x10, 2 concurrent: sync", result.output)
+        with app.app_context():
+            self.assertEqual(Employed.query.filter(Employed.name.like("Employe %")).count(), 0)
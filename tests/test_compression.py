@@ -0,0 +1,132 @@
+"""
+Test cases for the response compression
+"""
+import gzip
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask, Response, jsonify
+from werkzeug.http import parse_etags
+from service.common import compression
+
+LARGE = [{"id": i, "name": "John Doe", "job_position": "Engineer"} for i in range(100)]
+
+
+def tagged():
+    """Returns a large response with an ETag"""
+    response = jsonify(LARGE)
+    response.set_etag("abc")
+    return response
+
+
+def create_app(**config):
+    """Returns an app whose responses are compressed"""
+    app = Flask(__name__)
+    app.config.update(
+        COMPRESS_ALGORITHMS="br,gzip",
+        COMPRESS_MIN_SIZE=500,
+        COMPRESS_LEVEL=6,
+        COMPRESS_BR_LEVEL=4,
+        COMPRESS_MIMETYPES="application/json,application/x-ndjson",
+    )
+    app.config.update(config)
+    app.add_url_rule("/small", "small", lambda: jsonify(status="OK"))
+    app.add_url_rule("/large", "large", lambda: jsonify(LARGE))
+    app.add_url_rule("/tagged", "tagged", tagged)
+    app.add_url_rule("/text", "text", lambda: "x" * 1000)
+    app.add_url_rule(
+        "/stream", "stream",
+        lambda: Response((f"{i}\n" for i in range(1000)), mimetype="application/x-ndjson"),
+    )
+    compression.init_compression(app)
+    return app
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(TestCase):
+    """Test Cases for the response compression"""
+
+    def setUp(self):
+        self.client = create_app().test_client()
+        self.gzip = {"Accept-Encoding": "gzip, deflate"}
+
+    def test_compress_large_response(self):
+        """It should gzip a large JSON response"""
+        plain = self.client.get("/large")
+        resp = self.client.get("/large", headers=self.gzip)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(int(resp.headers["Content-Length"]), len(plain.data))
+
+    def test_skip_small_response(self):
+        """It should not compress a response under the minimum size"""
+        resp = self.client.get("/small", headers=self.gzip)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+
+    def test_skip_not_accepted(self):
+        """It should only compress with an encoding the client accepts"""
+        for headers in ({}, {"Accept-Encoding": "identity"}, {"Accept-Encoding": "gzip;q=0"}):
+            resp = self.client.get("/large", headers=headers)
+            self.assertNotIn("Content-Encoding", resp.headers, headers)
+
+    def test_skip_other_mimetypes(self):
+        """It should not compress the responses that are not JSON"""
+        resp = self.client.get("/text", headers=self.gzip)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compress_stream(self):
+        """It should compress a streamed response chunk by chunk"""
+        resp = self.client.get("/stream", headers=self.gzip)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        expected = "".join(f"{i}\n" for i in range(1000)).encode("ascii")
+        self.assertEqual(gzip.decompress(resp.data), expected)
+
+    def test_brotli_preferred(self):
+        """It should prefer brotli only when it is installed"""
+        headers = {"Accept-Encoding": "gzip, br"}
+        with patch.object(compression, "brotli", None):
+            resp = create_app().test_client().get("/large", headers=headers)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        with patch.object(compression, "brotli"), \
+                patch.object(compression.Compression, "compressor") as compressor:
+            compressor.return_value.compress.return_value = b"compressed"
+            compressor.return_value.flush.return_value = b""
+            resp = create_app().test_client().get("/large", headers=headers)
+        compressor.assert_called_once_with("br")
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(resp.data, b"compressed")
+
+    def test_etag_per_encoding(self):
+        """It should give the compressed responses the ETag of their encoding"""
+        self.assertEqual(self.client.get("/tagged").headers["ETag"], '"abc"')
+        resp = self.client.get("/tagged", headers=self.gzip)
+        self.assertEqual(resp.headers["ETag"], '"abc-gzip"')
+        with patch.object(compression, "brotli"), \
+                patch.object(compression.Compression, "compressor") as compressor:
+            compressor.return_value.compress.return_value = b"compressed"
+            compressor.return_value.flush.return_value = b""
+            resp = create_app().test_client().get("/tagged", headers={"Accept-Encoding": "br"})
+        self.assertEqual(resp.headers["ETag"], '"abc-br"')
+
+    def test_matching_etag(self):
+        """It should match the ETags of any encoding with the uncompressed one"""
+        self.assertEqual(compression.identity_etag("abc-gzip"), "abc")
+        self.assertEqual(compression.identity_etag("abc-br"), "abc")
+        self.assertEqual(compression.identity_etag("abc"), "abc")
+        etags = parse_etags('"xyz", "abc-gzip"')
+        self.assertEqual(compression.matching_etag(etags, "abc"), "abc-gzip")
+        self.assertIsNone(compression.matching_etag(etags, "ab"))
+        self.assertEqual(compression.matching_etag(parse_etags("*"), "abc"), "abc")
+        weak = parse_etags('W/"abc-br"')
+        self.assertEqual(compression.matching_etag(weak, "abc"), "abc-br")
+        self.assertIsNone(compression.matching_etag(weak, "abc", weak=False))
+
+    def test_disabled(self):
+        """It should not compress without algorithms"""
+        client = create_app(COMPRESS_ALGORITHMS="").test_client()
+        resp = client.get("/large", headers=self.gzip)
+        self.assertNotIn("Content-Encoding", resp.headers)
@@ -0,0 +1,65 @@
+"""
+Test cases for the JSON encoders
+"""
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch
+from flask import json as flask_json
+from service.common.json_provider import JSONEncoder, OrjsonEncoder
+
+DOCUMENT = {
+    "id": 1,
+    "name": "John Doe",
+    "salary": Decimal("1234.50"),
+    "status": True,
+    "photo": None,
+    "beneficiaries": [{"id": 2, "name": "Jane Doe", "date_born": "2010-01-01"}],
+}
+
+
+######################################################################
+#  J S O N   E N C O D E R   T E S T   C A S E S
+######################################################################
+class TestJSONEncoders(TestCase):
+    """Test Cases for the JSON encoders"""
+
+    def test_same_output_as_flask(self):
+        """It should encode the documents byte for byte like Flask does"""
+        expected = json.dumps([DOCUMENT], cls=flask_json.JSONEncoder, sort_keys=True, separators=(",", ":"))
+        for encoder in (JSONEncoder, OrjsonEncoder):
+            self.assertEqual(json.dumps([DOCUMENT], cls=encoder, sort_keys=True), expected, encoder)
+
+    def test_encode_dates(self):
+        """It should encode dates and datetimes in ISO 8601"""
+        data = {"day": date(2020, 1, 2), "at": datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc)}
+        expected = '{"at":"2020-01-02T03:04:05.000006+00:00","day":"2020-01-02"}'
+        for encoder in (JSONEncoder, OrjsonEncoder):
+            self.assertEqual(json.dumps(data, cls=encoder, sort_keys=True), expected, encoder)
+
+    def test_indent(self):
+        """It should only add spaces to indented output"""
+        for encoder in (JSONEncoder, OrjsonEncoder):
+            self.assertEqual(json.dumps({"a": [1]}, cls=encoder), '{"a":[1]}')
+            self.assertEqual(json.dumps({"a": 1}, cls=encoder, indent=2), '{\n  "a": 1\n}')
+
+    def test_orjson_non_ascii(self):
+        """It should escape the non ASCII characters of the orjson output like the standard library"""
+        data = {"name": "José Núñez 😀", "beneficiaries": [{"name": "Zoë"}]}
+        with patch.object(JSONEncoder, "_encode") as stdlib:
+            escaped = json.dumps(data, cls=OrjsonEncoder)
+            utf8 = json.dumps(data, cls=OrjsonEncoder, ensure_ascii=False)
+        stdlib.assert_not_called()
+        self.assertEqual(escaped, json.dumps(data, cls=JSONEncoder))
+        self.assertEqual(utf8, json.dumps(data, cls=JSONEncoder, ensure_ascii=False))
+
+    def test_orjson_fallbacks(self):
+        """It should encode what orjson cannot like the standard library"""
+        for data in ({"name": "José"}, {"big": 2 ** 70}):
+            self.assertEqual(
+                json.dumps(data, cls=OrjsonEncoder),
+                json.dumps(data, cls=JSONEncoder),
+            )
+        self.assertEqual(json.dumps({"name": "José"}, cls=OrjsonEncoder), '{"name":"Jos\\u00e9"}')
+        self.assertRaises(TypeError, json.dumps, {"bad": object()}, cls=OrjsonEncoder)
@@ -0,0 +1,91 @@
+"""
+Test cases for the Prometheus metrics
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service.common import metrics
+
+# a gunicorn worker recording metrics in the shared directory
+WORKER = """
+import os
+from service.common import metrics
+
+metrics.REPLICA_EVENTS.labels("down").inc()
+metrics.STORAGE_SECONDS.labels("put").observe(0.5)
+metrics.POOL_CONNECTIONS.labels("size").set(5)
+print(os.getpid())
+"""
+
+
+def run_worker(directory):
+    """Runs a process recording metrics in the directory, returns its pid"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory, DB_CREATE_ALL="false")
+    result = subprocess.run(
+        [sys.executable, "-c", WORKER], env=env, check=True, capture_output=True, text=True, timeout=60
+    )
+    return int(result.stdout.split()[-1])
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Test Cases for the metrics"""
+
+    def setUp(self):
+        metrics.REPLICA_EVENTS.clear()
+
+    def test_render(self):
+        """It should render the metrics of this process in the text format"""
+        metrics.REPLICA_EVENTS.labels('say "hi"\\n').inc(3)
+        text = metrics.render().decode("utf-8")
+        self.assertIn("# TYPE db_replica_events_total counter", text)
+        self.assertIn('db_replica_events_total{event="say \\"hi\\"\\\\n"} 3.0\n', text)
+        self.assertIn("# TYPE db_pool_checkout_duration_seconds histogram", text)
+
+    def test_pool_gauges(self):
+        """It should set the connection counts of the pool"""
+        pool = MagicMock(spec=["size", "checkedout"])
+        pool.size.return_value = 5
+        pool.checkedout.return_value = 2
+        metrics.pool_gauges(lambda: MagicMock(pool=pool))()
+        text = metrics.render().decode("utf-8")
+        self.assertIn('db_pool_connections{state="size"} 5.0\n', text)
+        self.assertIn('db_pool_connections{state="checkedout"} 2.0\n', text)
+
+    def test_add_up_workers(self):
+        """It should add up the workers, keeping the counters of the exited ones only"""
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+            first, second = run_worker(directory), run_worker(directory)
+            text = metrics.render().decode("utf-8")
+            self.assertIn('db_replica_events_total{event="down"} 2.0\n', text)
+            self.assertIn('storage_operation_duration_seconds_count{operation="put"} 2.0\n', text)
+            self.assertIn(f'db_pool_connections{{pid="{first}",state="size"}} 5.0\n', text)
+
+            metrics.worker_exited(first)
+            files = sorted(os.listdir(directory))
+            self.assertNotIn(f"counter_{first}.db", files)
+            self.assertIn("counter_exited.db", files)
+            metrics.worker_exited(second)
+            self.assertEqual(sorted(os.listdir(directory)), ["counter_exited.db", "histogram_exited.db"])
+            text = metrics.render().decode("utf-8")
+            self.assertIn('db_replica_events_total{event="down"} 2.0\n', text)
+            self.assertIn('storage_operation_duration_seconds_count{operation="put"} 2.0\n', text)
+            self.assertIn('storage_operation_duration_seconds_sum{operation="put"} 1.0\n', text)
+            self.assertNotIn("db_pool_connections{", text)
+
+            metrics.clean_directory()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_single_process(self):
+        """It should leave the files alone when the workers do not share a directory"""
+        with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": ""}), \
+                patch.object(metrics.multiprocess, "mark_process_dead") as mark_process_dead:
+            metrics.clean_directory()
+            metrics.worker_exited(1)
+        mark_process_dead.assert_not_called()
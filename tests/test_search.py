@@ -0,0 +1,33 @@
+"""
+Test cases for the trigram search
+
+"""
+from unittest import TestCase
+from service.common import search
+
+
+######################################################################
+#  T R I G R A M   T E S T   C A S E S
+######################################################################
+class TestTrigrams(TestCase):
+    """Test Cases for the pure Python trigram functions"""
+
+    def test_trigrams(self):
+        """It should pad every word like pg_trgm"""
+        self.assertEqual(search.trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(search.trigrams("a-b"), {"  a", " a ", "  b", " b "})
+        self.assertEqual(search.trigrams(""), set())
+
+    def test_similarity(self):
+        """It should rank identical names first"""
+        self.assertEqual(search.similarity("John Smith", "john smith"), 1.0)
+        self.assertGreater(search.similarity("Jhon Smith", "John Smith"), search.SIMILARITY_THRESHOLD)
+        self.assertEqual(search.similarity("xyz", "John Smith"), 0.0)
+
+    def test_partial_and_misspelled(self):
+        """It should match partial and misspelled names"""
+        self.assertGreater(search.score("smi", "John Smith"), 0)
+        self.assertGreater(search.score("Jhon Smit", "John Smith"), 0)
+        self.assertGreater(search.score("smith", "John Smith"), search.score("smi", "John Smith"))
+        self.assertEqual(search.score("xyz", "John Smith"), 0)
+        self.assertEqual(search.score("john", None), 0)
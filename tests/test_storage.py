@@ -0,0 +1,110 @@
+"""
+Test cases for the photo storage backends
+
+"""
+import base64
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import storage
+from service.common.storage import S3Storage, LocalStorage, MemoryStorage, StorageError
+
+
+######################################################################
+#  S 3   S T O R A G E   T E S T   C A S E S
+######################################################################
+class TestS3Storage(TestCase):
+    """Test Cases for S3Storage"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.storage = S3Storage(
+            bucket="photos",
+            public_url="https://photos.example.com/",
+            endpoint_url="https://s3.example.com",
+            region_name="us-east-1",
+            access_key_id="key",
+            secret_access_key="secret",
+            max_pool_connections=7,
+            connect_timeout=1,
+            read_timeout=2,
+        )
+
+    def test_lazy_client(self):
+        """It should create the client on first use with the pool settings"""
+        self.assertIsNone(self.storage._client)  # pylint: disable=protected-access
+        client = self.storage.client
+        self.assertIs(self.storage.client, client)
+        self.assertEqual(client.meta.config.max_pool_connections, 7)
+        self.assertEqual(client.meta.config.connect_timeout, 1)
+        self.assertEqual(client.meta.config.read_timeout, 2)
+
+    def test_client_per_process(self):
+        """It should create a new client after a fork"""
+        client = self.storage.client
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(self.storage.client, client)
+
+    def test_presign_post(self):
+        """It should presign an upload of a limited size without calling the storage"""
+        url, fields = self.storage.presign_post("uploads/a.png", "image/png", 1024, 60)
+        self.assertTrue(url.startswith("https://s3.example.com/photos"))
+        self.assertEqual(fields["key"], "uploads/a.png")
+        self.assertEqual(fields["Content-Type"], "image/png")
+        self.assertEqual(fields["acl"], "public-read")
+        policy = json.loads(base64.b64decode(fields["policy"]))
+        self.assertIn(["content-length-range", 1, 1024], policy["conditions"])
+        self.assertEqual(self.storage.url("uploads/a.png"), "https://photos.example.com/uploads/a.png")
+
+
+######################################################################
+#  L O C A L   A N D   M E M O R Y   S T O R A G E   T E S T   C A S E S
+######################################################################
+class TestLocalStorage(TestCase):
+    """Test Cases for LocalStorage and MemoryStorage"""
+
+    def test_local_storage(self):
+        """It should store the photos in a directory"""
+        with tempfile.TemporaryDirectory() as root:
+            local = LocalStorage(root, "http://localhost/photos/")
+            self.assertFalse(local.exists("uploads/a.png"))
+            local.put("uploads/a.png", b"image", "image/png")
+            self.assertTrue(local.exists("uploads/a.png"))
+            with open(os.path.join(root, "uploads", "a.png"), "rb") as stream:
+                self.assertEqual(stream.read(), b"image")
+            url, fields = local.presign_post("b.png", "image/png", 1024, 60)
+            self.assertTrue(url.startswith("file://"))
+            self.assertEqual(fields, {})
+
+    def test_local_storage_outside_root(self):
+        """It should not read or write outside of its directory"""
+        with tempfile.TemporaryDirectory() as root:
+            local = LocalStorage(root, "http://localhost/photos/")
+            self.assertFalse(local.exists("../secret"))
+            self.assertRaises(StorageError, local.put, "../secret", b"", "image/png")
+
+    def test_memory_storage(self):
+        """It should keep the photos in memory"""
+        memory = MemoryStorage()
+        memory.put("a.png", b"image", "image/png")
+        self.assertTrue(memory.exists("a.png"))
+        self.assertEqual(memory.url("a.png"), "memory://a.png")
+
+    def test_create_storage(self):
+        """It should build the backend selected in the config"""
+        config = dict(app.config, S3_ACCESS_KEY_ID="key", S3_SECRET_ACCESS_KEY="secret")
+        for backend, cls in (("s3", S3Storage), ("local", LocalStorage), ("memory", MemoryStorage)):
+            config["STORAGE_BACKEND"] = backend
+            self.assertIsInstance(storage.create_storage(config), cls)
+        config["STORAGE_BACKEND"] = "ftp"
+        self.assertRaises(StorageError, storage.create_storage, config)
+
+    def test_s3_without_keys(self):
+        """It should refuse the s3 storage without its keys"""
+        for keys in ({}, {"S3_ACCESS_KEY_ID": "key"}, {"S3_SECRET_ACCESS_KEY": "secret"}):
+            config = dict(app.config, STORAGE_BACKEND="s3", S3_ACCESS_KEY_ID=None, S3_SECRET_ACCESS_KEY=None)
+            config.update(keys)
+            self.assertRaises(StorageError, storage.create_storage, config)
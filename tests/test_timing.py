@@ -0,0 +1,71 @@
+"""
+Test cases for the request timings
+"""
+import json
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from service.common import timing
+
+
+def create_app(**config):
+    """Returns an app whose requests are timed"""
+    app = Flask(__name__)
+    app.config.update(SERVER_TIMING=True, SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_MAX_STATEMENTS=2)
+    app.config.update(config)
+
+    def work():
+        for number in range(3):
+            timing.record("db", 0.002, f"SELECT {number}")
+        with timing.timed("storage"):
+            pass
+        return "done"
+
+    app.add_url_rule("/work", "work", work)
+    timing.init_timing(app)
+    return app
+
+
+######################################################################
+#  T I M I N G   T E S T   C A S E S
+######################################################################
+class TestTiming(TestCase):
+    """Test Cases for the request timings"""
+
+    def test_server_timing(self):
+        """It should report the time of every step in Server-Timing"""
+        resp = create_app().test_client().get("/work")
+        header = resp.headers["Server-Timing"]
+        self.assertIn('db;dur=6.0;desc="3 queries"', header)
+        self.assertIn('storage;dur=', header)
+        self.assertIn("total;dur=", header)
+
+    def test_server_timing_disabled(self):
+        """It should not add the header when disabled"""
+        resp = create_app(SERVER_TIMING=False).test_client().get("/work")
+        self.assertNotIn("Server-Timing", resp.headers)
+
+    def test_slow_request_log(self):
+        """It should log the slow requests with their statements"""
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            create_app(SLOW_REQUEST_THRESHOLD=0.000001).test_client().get("/work?id=1")
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["event"], "slow_request")
+        self.assertEqual(entry["route"], "/work")
+        self.assertEqual(entry["status"], 200)
+        self.assertEqual([s["sql"] for s in entry["statements"]], ["SELECT 0", "SELECT 1"])
+        self.assertEqual(entry["dropped_statements"], 1)
+        self.assertEqual(entry["steps"]["db"]["count"], 3)
+
+    def test_fast_request_not_logged(self):
+        """It should not log the requests under the threshold"""
+        with patch.object(timing.logger, "warning") as warning:
+            create_app(SLOW_REQUEST_THRESHOLD=60).test_client().get("/work")
+        warning.assert_not_called()
+
+    def test_outside_request(self):
+        """It should ignore the timings outside of a request"""
+        self.assertIsNone(timing.current())
+        timing.record("db", 1.0, "SELECT 1")
+        with timing.timed("storage"):
+            pass
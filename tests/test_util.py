@@ -0,0 +1,119 @@
+"""
+Test cases for the utility functions
+
+"""
+import base64
+import hashlib
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import metrics, storage, util
+
+IMAGE_BYTES = b"\x89PNG fake image"
+IMAGE = "data:image/png;base64," + base64.b64encode(IMAGE_BYTES).decode("ascii")
+KEY = hashlib.sha256(IMAGE_BYTES).hexdigest() + ".png"
+
+
+######################################################################
+#  U P L O A D   I M A G E   T E S T   C A S E S
+######################################################################
+class TestUploadImg(TestCase):
+    """Test Cases for upload_img"""
+
+    def setUp(self):
+        """This runs before each test"""
+        util.KNOWN_KEYS.clear()
+        self.storage = storage.MemoryStorage("https://photos.example.com/")
+        patcher = patch("service.common.storage.STORAGE", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_upload_new_image(self):
+        """It should upload a new image under its content hash"""
+        metrics.STORAGE_SECONDS.clear()
+        url = util.upload_img(IMAGE, "John Doe")
+        self.assertEqual(url, "https://photos.example.com/" + KEY)
+        self.assertEqual(self.storage.objects[KEY], (IMAGE_BYTES, "image/png"))
+        timed = {
+            sample.labels["operation"]: sample.value
+            for sample in metrics.STORAGE_SECONDS.collect()[0].samples if sample.name.endswith("_count")
+        }
+        self.assertEqual(timed, {"exists": 1, "put": 1})
+
+    def test_upload_same_image_once(self):
+        """It should upload the same image only once"""
+        with patch.object(self.storage, "put", wraps=self.storage.put) as put_mock, \
+                patch.object(self.storage, "exists", wraps=self.storage.exists) as exists_mock:
+            first = util.upload_img(IMAGE, "John Doe")
+            second = util.upload_img(IMAGE, "Jane Doe")
+        self.assertEqual(first, second)
+        put_mock.assert_called_once()
+        exists_mock.assert_called_once()
+
+    def test_image_already_stored(self):
+        """It should not upload an image the storage already has"""
+        self.storage.put(KEY, IMAGE_BYTES, "image/png")
+        with patch.object(self.storage, "put") as put_mock:
+            util.upload_img(IMAGE, "John Doe")
+        put_mock.assert_not_called()
+        self.assertIn(KEY, util.KNOWN_KEYS)
+
+    def test_presign_upload(self):
+        """It should presign the upload of a new photo key"""
+        key, url, fields = util.presign_upload("image/jpeg")
+        self.assertTrue(key.startswith("uploads/"))
+        self.assertTrue(key.endswith(".jpeg"))
+        self.assertEqual(url, "memory://" + key)
+        self.assertEqual(fields["Content-Type"], "image/jpeg")
+        self.assertTrue(util.is_upload_key(key))
+        self.assertRaises(ValueError, util.presign_upload, "text/html")
+
+    def test_is_upload_key(self):
+        """It should only accept the keys issued for the photo uploads"""
+        name = "0123456789abcdef0123456789abcdef"
+        self.assertTrue(util.is_upload_key(f"uploads/{name}.png"))
+        for key in (
+            f"{name}.png",  # a photo uploaded by upload_img
+            f"uploads/{name}.html",
+            f"uploads/{name}",
+            f"uploads/../{name}.png",
+            f"private/uploads/{name}.png",
+            "uploads/.png",
+            None,
+            42,
+        ):
+            self.assertFalse(util.is_upload_key(key), key)
+
+
+######################################################################
+#  L R U   S E T   T E S T   C A S E S
+######################################################################
+class TestLRUSet(TestCase):
+    """Test Cases for LRUSet"""
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used key"""
+        keys = util.LRUSet(2)
+        keys.add("a")
+        keys.add("b")
+        self.assertIn("a", keys)
+        keys.add("c")
+        self.assertIn("a", keys)
+        self.assertNotIn("b", keys)
+        self.assertIn("c", keys)
+        self.assertEqual(len(keys), 2)
+
+
+######################################################################
+#  C U R S O R   T E S T   C A S E S
+######################################################################
+class TestCursor(TestCase):
+    """Test Cases for the pagination cursors"""
+
+    def test_cursor_round_trip(self):
+        """It should decode the id stored in a cursor"""
+        self.assertEqual(util.decode_cursor(util.encode_cursor(42)), 42)
+
+    def test_bad_cursor(self):
+        """It should not decode a malformed cursor"""
+        for cursor in ("%%%", "bm90IGpzb24", util.encode_cursor("42")):
+            self.assertRaises(ValueError, util.decode_cursor, cursor)
@@ -0,0 +1,64 @@
+"""
+Test cases for the payload validation
+
+"""
+from unittest import TestCase
+from service.common import validation
+from service.models import DataValidationError
+from tests.factories import EmployedFactory, BeneficiaryFactory
+
+
+######################################################################
+#  V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestValidation(TestCase):
+    """Test Cases for the payload schemas"""
+
+    def _document(self):
+        """Builds a valid {employe, beneficiary} document"""
+        return {
+            "employe": EmployedFactory().serialize(),
+            "beneficiary": [BeneficiaryFactory().serialize()],
+        }
+
+    def test_valid_document(self):
+        """It should accept a valid document"""
+        document = self._document()
+        self.assertEqual(validation.document_errors(document), [])
+        validation.validate_document(document)
+        document["beneficiary"] = None
+        validation.validate_document(document)
+
+    def test_all_errors_at_once(self):
+        """It should report every invalid field"""
+        document = self._document()
+        del document["employe"]["salary"]
+        document["employe"]["date_hire"] = "31/12/2020"
+        document["employe"]["name"] = "x" * 65
+        document["beneficiary"][0]["gender"] = 3
+        with self.assertRaises(DataValidationError) as context:
+            validation.validate_document(document)
+        fields = [e["field"] for e in context.exception.errors]
+        self.assertEqual(
+            sorted(fields),
+            ["beneficiary[0].gender", "employe.date_hire", "employe.name", "employe.salary"],
+        )
+
+    def test_bad_documents(self):
+        """It should not accept malformed documents"""
+        for document in ([], {}, {"employe": []}, {"employe": {}, "beneficiary": {}}):
+            self.assertNotEqual(validation.document_errors(document), [], document)
+
+    def test_salary(self):
+        """It should accept numbers that fit in the salary column"""
+        for value in (1000, 1500.5, "2000.25"):
+            self.assertIsNone(validation.salary(value), value)
+        for value in (True, "abc", "NaN", 1e9, [1]):
+            self.assertIsNotNone(validation.salary(value), value)
+
+    def test_photo(self):
+        """It should accept image data uris and short urls"""
+        self.assertIsNone(validation.photo("data:image/png;base64,iVBORw0KGgoAA"))
+        self.assertIsNone(validation.photo("https://example.com/a.png"))
+        self.assertIsNotNone(validation.photo("data:text/html;base64,PGh0bWw+"))
+        self.assertIsNotNone(validation.photo("https://example.com/" + "a" * 150))